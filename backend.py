@@ -0,0 +1,177 @@
+import os
+import sys
+import warnings
+import torch
+from torch import nn
+from transformers.modeling_outputs import SequenceClassifierOutput
+from transformers.pytorch_utils import Conv1D
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+# =============================
+# INFERENCE BACKENDS
+# =============================
+
+# fp32: eager fp32 weights (what the loaders always did)
+# int8: dynamic int8 quantization of every Linear layer (CPU only)
+# compile: torch.compile of the forward pass
+# torchscript: traced forward pass (fixed-signature models only)
+INFERENCE_MODES = ("fp32", "int8", "compile", "torchscript")
+
+SUPPORTED_MODES = {
+    "spell_corrector": ("fp32", "int8", "compile"),
+    "gliner": ("fp32", "int8", "compile"),
+    "gpt2": ("fp32", "int8", "compile"),
+    "classifier": ("fp32", "int8", "compile", "torchscript"),
+}
+
+
+def parse_inference_mode(setting):
+    # "int8" applies to every model, "gpt2=int8,classifier=torchscript" sets them one by one
+    if isinstance(setting, dict):
+        return dict(setting)
+    setting = (setting or "fp32").strip()
+    if "=" not in setting:
+        return {kind: setting for kind in SUPPORTED_MODES}
+    modes = {}
+    for item in setting.split(","):
+        kind, _, mode = item.partition("=")
+        modes[kind.strip()] = mode.strip()
+    return modes
+
+
+def resolve_inference_mode(kind: str, inference_mode=None):
+    if inference_mode is None:
+        inference_mode = os.environ.get("CHATBOT_INFERENCE_MODE", "fp32")
+    mode = parse_inference_mode(inference_mode).get(kind, "fp32")
+    if mode not in SUPPORTED_MODES[kind]:
+        print(f"Inference mode '{mode}' is not supported for {kind}, using fp32")
+        return "fp32"
+    return mode
+
+
+def resident_memory_mb():
+    # Current RSS from /proc where available, peak RSS otherwise (macOS reports bytes, Linux KiB)
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    if resource is None:
+        return 0.0
+    return peak_memory_mb()
+
+
+def process_memory_mb(pid="self"):
+    # {"rss", "pss"} in MB for any process (Linux). RSS counts shared pages in full for every
+    # process mapping them; PSS splits them between those processes, so PSS sums correctly.
+    memory = {"rss": 0.0, "pss": 0.0}
+    for path, field, key in ((f"/proc/{pid}/status", "VmRSS:", "rss"), (f"/proc/{pid}/smaps_rollup", "Pss:", "pss")):
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.startswith(field):
+                        memory[key] = int(line.split()[1]) / 1024.0
+                        break
+        except OSError:
+            pass
+    return memory
+
+
+def peak_memory_mb():
+    # Highest RSS this process has reached so far
+    if resource is None:
+        return resident_memory_mb()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+# =============================
+# MODE IMPLEMENTATIONS
+# =============================
+
+def conv1d_to_linear(module: nn.Module):
+    # GPT-2 uses transformers' Conv1D (a transposed Linear), which dynamic quantization skips
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            in_features, out_features = child.weight.shape
+            linear = nn.Linear(in_features, out_features)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            conv1d_to_linear(child)
+    return module
+
+
+def quantize_int8(module: nn.Module):
+    with warnings.catch_warnings():
+        # torch.ao eager quantization is deprecated in favour of torchao, but is still what ships with torch
+        warnings.simplefilter("ignore", DeprecationWarning)
+        return torch.ao.quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+class TracedClassifier(nn.Module):
+    # Gives a traced logits-only module the `outputs.logits` interface is_ood expects
+
+    def __init__(self, traced, config):
+        super().__init__()
+        self.traced = traced
+        self.config = config
+
+    def forward(self, input_ids, attention_mask=None, **kwargs):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        return SequenceClassifierOutput(logits=self.traced(input_ids, attention_mask))
+
+
+class _LogitsOnly(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+
+def trace_classifier(model, tokenizer):
+    device = next(model.parameters()).device
+    example = tokenizer(
+        ["How do I get a refund?", "How can I upgrade my ticket for the upcoming event in Hyderabad?"],
+        return_tensors="pt", padding=True
+    ).to(device)
+    with torch.no_grad():
+        traced = torch.jit.trace(
+            _LogitsOnly(model), (example["input_ids"], example["attention_mask"]), check_trace=False
+        )
+    return TracedClassifier(traced, model.config).eval()
+
+
+def apply_inference_mode(model, kind: str, mode: str, tokenizer=None):
+    # Returns the model to use; fp32 returns it untouched
+    if mode == "fp32":
+        return model
+    if mode == "int8":
+        device = model.device if kind == "gliner" else next(model.parameters()).device
+        if device.type != "cpu":
+            print(f"int8 dynamic quantization only runs on CPU, keeping fp32 for {kind}")
+            return model
+        if kind == "gliner":
+            quantize_int8(model.model)
+            return model
+        if kind == "gpt2":
+            conv1d_to_linear(model)
+        return quantize_int8(model)
+    if mode == "compile":
+        if kind == "gliner":
+            model.compile() # GLiNER compiles its inner model
+            return model
+        model.compile(dynamic=True) # Query lengths vary, avoid a recompile per shape
+        return model
+    if mode == "torchscript":
+        return trace_classifier(model, tokenizer)
+    raise ValueError(f"Unknown inference mode: {mode}")
@@ -0,0 +1,122 @@
+"""Latency and accuracy of the fused DistilBERT front end against the classifier + GLiNER path.
+
+The separate path runs the DistilBERT classifier (OOD verdict) and GLiNER (EVENT/CITY spans)
+on each query. The fused path gets both from one DistilBERT pass, with the entity head
+distilled from GLiNER. Unless --head is given, a head is trained here on questions built
+from some cities and events, and evaluated on held-out cities and events plus the example,
+intent and out-of-domain questions. GLiNER's output is the reference for the accuracy figures.
+
+    python -m benchmarks.frontend
+    python -m benchmarks.frontend --head entity_head
+    python -m benchmarks.frontend --tiny
+"""
+import argparse
+import time
+
+import torch
+
+from benchmarks.load_test import OOD_QUERIES, latency_summary, print_table
+from frontend import CITIES, EVENTS, EntityHead, FusedFrontEnd, distillation_queries, teacher_entities, train_entity_head
+from pipeline import (
+    CITY_LABELS, GLINER_LABELS, GLINER_THRESHOLD, ChatbotPipeline, entities_to_placeholders, example_queries,
+    is_ood_batch, normalize_query
+)
+from retrieval import INTENTS
+
+TRAIN_CITIES, TRAIN_EVENTS = CITIES[:8], EVENTS[:7]
+
+
+def split_queries(seed: int):
+    intent_questions = [q for spec in INTENTS.values() for q in spec["questions"]]
+    train = distillation_queries(TRAIN_EVENTS, TRAIN_CITIES, extra=intent_questions[::2], seed=seed)
+    held_out = (distillation_queries(EVENTS, CITIES[8:], limit=80, seed=seed)
+                + distillation_queries(EVENTS[7:], TRAIN_CITIES, limit=40, seed=seed))
+    test = held_out + example_queries + intent_questions[1::2] + OOD_QUERIES
+    return [normalize_query(q) for q in train], [normalize_query(q) for q in test]
+
+
+def span_key(entity):
+    return ("city" if entity["label"] in CITY_LABELS else "event", entity["text"].lower())
+
+
+def timed(run, queries, batch_size: int):
+    # Per-query seconds when queries arrive one at a time, and per-query seconds in batches
+    outputs, singles = [], []
+    for query in queries:
+        start = time.perf_counter()
+        outputs.extend(run([query]))
+        singles.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch_size):
+        run(queries[i:i + batch_size])
+    return outputs, singles, (time.perf_counter() - start) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tiny", action="store_true", help="use tiny random stand-in models (no downloads)")
+    parser.add_argument("--head", help="entity head directory from `python frontend.py` (default: train one here)")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    if args.tiny:
+        from benchmarks.tiny_models import tiny_pipeline
+        chatbot = tiny_pipeline(seed=args.seed)
+    else:
+        chatbot = ChatbotPipeline.from_pretrained()
+    clf_model, clf_tokenizer, gliner = chatbot.clf_model, chatbot.clf_tokenizer, chatbot.gliner_model
+    train, test = split_queries(args.seed)
+
+    if args.head:
+        head = EntityHead.load(args.head)
+        print(f"Entity head from {args.head}")
+    else:
+        entities = teacher_entities(gliner, train, GLINER_LABELS, GLINER_THRESHOLD)
+        head, report = train_entity_head(clf_model, clf_tokenizer, train, entities, GLINER_LABELS, seed=args.seed)
+        print(f"Entity head trained on {len(train)} questions ({report['tokens']} tokens, "
+              f"{report['token_accuracy']:.1%} token accuracy)")
+    front_end = FusedFrontEnd(clf_model, clf_tokenizer, head, GLINER_LABELS, GLINER_THRESHOLD)
+
+    def separate(queries):
+        flags = is_ood_batch(queries, clf_model, clf_tokenizer)
+        spans = gliner.inference(queries, GLINER_LABELS, threshold=GLINER_THRESHOLD, batch_size=len(queries))
+        return [{"is_ood": flag, "entities": found} for flag, found in zip(flags, spans)]
+
+    separate(test[:2]) # Warm-up
+    front_end.run(test[:2])
+    reference, separate_singles, separate_batched = timed(separate, test, args.batch_size)
+    fused, fused_singles, fused_batched = timed(front_end.run, test, args.batch_size)
+
+    rows = []
+    for name, singles, batched in (("classifier+gliner", separate_singles, separate_batched),
+                                   ("fused", fused_singles, fused_batched)):
+        row = {"path": name, **latency_summary(singles), "batched_ms": 1000.0 * batched}
+        rows.append(row)
+    for row in rows:
+        row["speedup"] = rows[0]["mean_ms"] / row["mean_ms"]
+
+    ood_agree = sum(r["is_ood"] == f["is_ood"] for r, f in zip(reference, fused))
+    placeholders_agree = sum(
+        entities_to_placeholders(r["entities"]) == entities_to_placeholders(f["entities"])
+        for r, f in zip(reference, fused)
+    )
+    expected = [{span_key(e) for e in r["entities"]} for r in reference]
+    found = [{span_key(e) for e in f["entities"]} for f in fused]
+    true_positives = sum(len(e & f) for e, f in zip(expected, found))
+    precision = true_positives / max(1, sum(len(f) for f in found))
+    recall = true_positives / max(1, sum(len(e) for e in expected))
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+    print(f"{len(test)} held-out questions, labels {','.join(GLINER_LABELS)}, threshold {GLINER_THRESHOLD}")
+    print_table("Per-query front-end latency (OOD verdict + entities)", rows,
+                ["path", "mean_ms", "p50_ms", "p95_ms", "batched_ms", "speedup"])
+    print_table("Fused front end against classifier + GLiNER", [{
+        "metric": "agreement", "ood": ood_agree / len(test), "placeholders": placeholders_agree / len(test),
+        "span_precision": precision, "span_recall": recall, "span_f1": f1,
+    }], ["metric", "ood", "placeholders", "span_precision", "span_recall", "span_f1"])
+
+
+if __name__ == "__main__":
+    main()
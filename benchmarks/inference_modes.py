@@ -0,0 +1,141 @@
+"""Compare the inference backends in backend.py against fp32 eager.
+
+Each (model, mode) pair runs in its own subprocess so resident memory is measured
+for that model alone. Outputs of every mode are checked against the fp32 run.
+
+    python -m benchmarks.inference_modes
+    python -m benchmarks.inference_modes --models gpt2,classifier --modes fp32,int8 --repeats 5
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+import torch
+
+QUERIES = [
+    "How do I buy a ticket?", "How can I upgrade my ticket for the upcoming event in Hyderabad?",
+    "How do I change my personal details on my ticket?", "How can I find details about upcoming events?",
+    "How do I contact customer service?", "How do I get a refund?", "What is the ticket cancellation fee?",
+    "How can I track my ticket cancellation status?", "How can I sell my ticket?",
+    "How can I cancle my tiket for the upcoming event in lundon?", "What's the weather like today?",
+]
+
+
+# =============================
+# WORKER (one model, one mode)
+# =============================
+
+def _run_model(kind, mode, repeats):
+    import pipeline
+    from backend import resident_memory_mb
+
+    rss_before = resident_memory_mb()
+    start = time.perf_counter()
+    if kind == "spell_corrector":
+        model = pipeline.load_spell_corrector(mode)
+        run = lambda q: pipeline.correct_spelling_batch([q], model)[0]
+    elif kind == "gliner":
+        model = pipeline.load_gliner_model(mode)
+        run = lambda q: sorted(
+            (e["label"], e["text"]) for e in model.predict_entities(
+                q, pipeline.GLINER_LABELS, threshold=pipeline.GLINER_THRESHOLD
+            )
+        )
+    elif kind == "gpt2":
+        model, tokenizer = pipeline.load_gpt2_model_and_tokenizer(mode)
+
+        def run(q):
+            # Next-token logits after the prompt: deterministic, unlike the sampled reply
+            inputs = tokenizer(f"Instruction: {q} Response:", return_tensors="pt").to(pipeline.get_device())
+            with torch.no_grad():
+                logits = model(**inputs).logits[0, -1]
+            return logits.float().tolist()
+    elif kind == "classifier":
+        model, tokenizer = pipeline.load_classifier_model(mode)
+
+        def run(q):
+            inputs = tokenizer(q, return_tensors="pt", truncation=True, max_length=256).to(pipeline.get_device())
+            with torch.no_grad():
+                return model(**inputs).logits[0].float().tolist()
+    else:
+        raise ValueError(f"Unknown model: {kind}")
+    load_seconds = time.perf_counter() - start
+
+    outputs = [run(q) for q in QUERIES] # Also warms up compiled modes
+    latencies = []
+    for _ in range(repeats):
+        for q in QUERIES:
+            t = time.perf_counter()
+            run(q)
+            latencies.append((time.perf_counter() - t) * 1000.0)
+    return {
+        "model": kind, "mode": mode, "outputs": outputs, "load_s": load_seconds,
+        "rss_mb": resident_memory_mb(), "model_rss_mb": resident_memory_mb() - rss_before,
+        "latency_ms_mean": statistics.fmean(latencies), "latency_ms_p50": statistics.median(latencies),
+    }
+
+
+# =============================
+# VALIDATION
+# =============================
+
+def compare_outputs(kind, reference, candidate):
+    if kind in ("gpt2", "classifier"):
+        ref = torch.tensor(reference)
+        cand = torch.tensor(candidate)
+        return {
+            "agreement": (ref.argmax(-1) == cand.argmax(-1)).float().mean().item(),
+            "max_abs_diff": (ref - cand).abs().max().item(),
+        }
+    matches = sum(r == c for r, c in zip(reference, candidate))
+    return {"agreement": matches / len(reference), "max_abs_diff": None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", default="spell_corrector,gliner,gpt2,classifier")
+    parser.add_argument("--modes", default="fp32,int8,compile,torchscript")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--worker", nargs=2, metavar=("MODEL", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(_run_model(*args.worker, args.repeats)))
+        return
+
+    from backend import SUPPORTED_MODES
+
+    modes = args.modes.split(",")
+    if "fp32" in modes:
+        modes.remove("fp32")
+    print(f"{'model':<16}{'mode':<13}{'p50 ms':>9}{'speedup':>9}{'RSS MB':>9}{'agree':>8}{'max diff':>10}")
+    for kind in args.models.split(","):
+        results = []
+        for mode in ["fp32"] + [m for m in modes if m in SUPPORTED_MODES[kind]]:
+            proc = subprocess.run(
+                [sys.executable, "-m", "benchmarks.inference_modes", "--worker", kind, mode,
+                 "--repeats", str(args.repeats)],
+                capture_output=True, text=True
+            )
+            if proc.returncode != 0:
+                print(f"{kind:<16}{mode:<13} failed: {proc.stderr.strip().splitlines()[-1:]}")
+                continue
+            results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        if not results or results[0]["mode"] != "fp32":
+            continue
+        reference = results[0]
+        for result in results:
+            check = compare_outputs(kind, reference["outputs"], result["outputs"])
+            speedup = reference["latency_ms_p50"] / result["latency_ms_p50"]
+            max_diff = "-" if check["max_abs_diff"] is None else f"{check['max_abs_diff']:.4f}"
+            print(
+                f"{kind:<16}{result['mode']:<13}{result['latency_ms_p50']:>9.1f}{speedup:>8.2f}x"
+                f"{result['rss_mb']:>9.0f}{check['agreement']:>8.0%}{max_diff:>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
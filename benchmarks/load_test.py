@@ -0,0 +1,244 @@
+"""Offline benchmark and load test for the chatbot pipeline, without the UI.
+
+Drives ChatbotPipeline with a fixed query corpus:
+  example        - the example queries offered in the app
+  typo           - typo-laden variants of them (exercise the spell corrector)
+  ood            - out-of-domain questions (answered with a fallback)
+  edge_at_limit  - as close to max_tokens (128) tokens as whole words allow, inside the length guard
+  edge_over      - one word longer, rejected by the length guard
+
+and reports:
+  - per-stage latency (calls, items, skips, mean, p50/p95/p99) from the stage histograms
+  - end-to-end latency per category from a sequential pass
+  - throughput and p50/p95/p99 at several concurrency levels, through the BatchScheduler
+  - load time and peak resident memory
+
+Answer caching is off by default so repeated queries pay for every stage; pass
+--cache-size to measure a warm cache instead. --tiny swaps in small randomly
+initialized models (benchmarks/tiny_models.py), so it runs in CI with no network.
+
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --tiny --concurrency 1,4,16 --requests 64 --json baseline.json
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from backend import peak_memory_mb, resident_memory_mb
+from metrics import METRICS
+from pipeline import ChatbotPipeline, example_queries, normalize_query
+from scheduler import BatchScheduler
+
+OOD_QUERIES = [
+    "What's the weather like today?", "Tell me a joke about cats.", "Who won the football world cup in 2018?",
+    "How do I bake sourdough bread?", "What is the capital of Australia?", "Can you help me with my math homework?",
+    "Recommend a good laptop for programming.", "How far is the moon from the earth?",
+]
+
+KNOWN_TYPOS = [
+    "How can I cancle my tiket for the upcoming event in lundon?", "how do i get a refnd?",
+    "Wht is the tickt cancelation fee?", "How can I sel my tickit?",
+]
+
+EDGE_FILLER = "I bought tickets for the concert and the festival but my plans changed".split()
+
+# =============================
+# QUERY CORPUS
+# =============================
+
+def typo_variant(query: str, rng: random.Random):
+    # Swap, drop or double one letter in up to two of the longer words
+    words = query.split()
+    candidates = [i for i, word in enumerate(words) if len(word) > 3 and word.isalpha()]
+    for i in rng.sample(candidates, min(2, len(candidates))):
+        word = words[i]
+        j = rng.randrange(1, len(word) - 1)
+        edit = rng.choice(("swap", "drop", "double"))
+        if edit == "swap":
+            word = word[:j] + word[j + 1] + word[j] + word[j + 2:]
+        elif edit == "drop":
+            word = word[:j] + word[j + 1:]
+        else:
+            word = word[:j] + word[j] + word[j:]
+        words[i] = word
+    return " ".join(words)
+
+
+def token_count(query: str, tokenizer):
+    # Counted the way validate_queries counts for the length guard
+    return len(tokenizer.encode(normalize_query(query), add_special_tokens=True))
+
+
+def edge_queries(tokenizer, max_tokens: int):
+    # Longest query within the guard and the shortest one past it
+    words = ["How", "do", "I", "get", "a", "refund", "if"]
+    i = 0
+    while token_count(" ".join(words), tokenizer) <= max_tokens:
+        words.append(EDGE_FILLER[i % len(EDGE_FILLER)])
+        i += 1
+    over = " ".join(words)
+    while token_count(" ".join(words), tokenizer) > max_tokens:
+        words.pop()
+    return " ".join(words), over
+
+
+def build_corpus(tokenizer, max_tokens: int = 128, seed: int = 0):
+    # [(category, query)]
+    rng = random.Random(seed)
+    corpus = [("example", query) for query in example_queries]
+    corpus += [("typo", query) for query in KNOWN_TYPOS]
+    corpus += [("typo", typo_variant(query, rng)) for query in example_queries]
+    corpus += [("ood", query) for query in OOD_QUERIES]
+    at_limit, over = edge_queries(tokenizer, max_tokens)
+    corpus += [("edge_at_limit", at_limit), ("edge_over", over)]
+    return corpus
+
+# =============================
+# MEASUREMENT
+# =============================
+
+def percentile(values, q: float):
+    # Nearest-rank percentile, q in [0, 100]
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(q / 100.0 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def latency_summary(seconds):
+    ms = [1000.0 * s for s in seconds]
+    return {
+        "count": len(ms), "mean_ms": statistics.fmean(ms) if ms else 0.0,
+        "p50_ms": percentile(ms, 50), "p95_ms": percentile(ms, 95), "p99_ms": percentile(ms, 99),
+    }
+
+
+def run_sequential(chatbot, corpus, repeats: int):
+    # One query at a time; returns end-to-end latencies per category
+    latencies = {}
+    for _ in range(repeats):
+        for category, query in corpus:
+            start = time.perf_counter()
+            chatbot.answer(query)
+            latencies.setdefault(category, []).append(time.perf_counter() - start)
+    return latencies
+
+
+def run_concurrent(chatbot, corpus, concurrency: int, requests: int):
+    # `requests` queries from `concurrency` client threads, through the scheduler like app sessions
+    # (the pipeline itself is not called from several threads: fast tokenizers are not thread-safe)
+    queries = [corpus[i % len(corpus)][1] for i in range(requests)]
+    scheduler = BatchScheduler(chatbot, max_queue_size=max(128, requests))
+
+    def timed(query):
+        start = time.perf_counter()
+        scheduler.answer(query)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(timed, queries))
+    wall = time.perf_counter() - start
+    result = {"concurrency": concurrency, "requests": requests, "wall_s": wall, "qps": requests / wall}
+    result.update(latency_summary(latencies))
+    result["avg_batch_size"] = scheduler.stats()["avg_batch_size"]
+    scheduler.shutdown()
+    return result
+
+# =============================
+# REPORT
+# =============================
+
+def print_table(title, rows, columns):
+    print(f"\n{title}")
+    first, rest = columns[0], columns[1:]
+    print(f"{first:<22}" + "".join(f"{name:>16}" for name in rest))
+    for row in rows:
+        print(f"{row[first]:<22}" + "".join(
+            f"{row[name]:>16.2f}" if isinstance(row[name], float) else f"{row[name]:>16}" for name in rest
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tiny", action="store_true", help="use tiny random stand-in models (no downloads)")
+    parser.add_argument("--inference-mode", default=None, help="see backend.py, e.g. int8 or gpt2=int8")
+    parser.add_argument("--repeats", type=int, default=1, help="sequential passes over the corpus")
+    parser.add_argument("--concurrency", default="1,4,8", help="comma-separated client thread counts")
+    parser.add_argument("--requests", type=int, default=32, help="requests per concurrency level")
+    parser.add_argument("--cache-size", type=int, default=0, help="stage/answer cache size (0 disables caching)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    random.seed(args.seed)
+    rss_before = resident_memory_mb()
+    start = time.perf_counter()
+    if args.tiny:
+        from benchmarks.tiny_models import tiny_pipeline
+        chatbot = tiny_pipeline(seed=args.seed, cache_size=args.cache_size)
+    else:
+        chatbot = ChatbotPipeline.from_pretrained(args.inference_mode, cache_size=args.cache_size)
+    chatbot.preload()
+    load_seconds = time.perf_counter() - start
+    corpus = build_corpus(chatbot.gpt2_tokenizer, chatbot.max_tokens, args.seed)
+    print(f"Loaded models in {load_seconds:.2f}s ({resident_memory_mb() - rss_before:.0f} MB); "
+          f"{len(corpus)} corpus queries")
+
+    chatbot.answer(example_queries[0]) # Warm-up
+    METRICS.reset()
+    chatbot.stats.reset()
+    sequential = run_sequential(chatbot, corpus, args.repeats)
+    # Stage percentiles are histogram bucket upper bounds, as Prometheus would report them
+    snapshot = chatbot.stats.snapshot()
+    stages = [
+        {"stage": stage, "calls": row["count"], "items": snapshot[stage]["items"],
+         "skipped": snapshot[stage]["skipped"], "mean_ms": 1000.0 * row["mean"],
+         "ms_per_item": snapshot[stage]["avg_ms_per_item"], "p50_ms": 1000.0 * row["p50"],
+         "p95_ms": 1000.0 * row["p95"], "p99_ms": 1000.0 * row["p99"]}
+        for stage, row in METRICS.summary("chatbot_stage_seconds").items()
+    ]
+    categories = [{"category": category, **latency_summary(values)} for category, values in sequential.items()]
+    all_latencies = [seconds for values in sequential.values() for seconds in values]
+    overall = latency_summary(all_latencies)
+
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    throughput = [run_concurrent(chatbot, corpus, level, args.requests) for level in levels]
+
+    print_table("Per-stage latency (sequential pass)", stages,
+                ["stage", "calls", "items", "skipped", "mean_ms", "ms_per_item", "p50_ms", "p95_ms", "p99_ms"])
+    print_table("End-to-end latency by category (sequential pass)", categories,
+                ["category", "count", "mean_ms", "p50_ms", "p95_ms", "p99_ms"])
+    print(f"\nOverall: p50 {overall['p50_ms']:.2f} ms, p95 {overall['p95_ms']:.2f} ms, p99 {overall['p99_ms']:.2f} ms")
+    print_table("Throughput (through the BatchScheduler)", throughput,
+                ["concurrency", "requests", "qps", "p50_ms", "p95_ms", "p99_ms", "avg_batch_size"])
+    peak_mb = peak_memory_mb()
+    print(f"\nPeak RSS: {peak_mb:.0f} MB")
+    answer_index = chatbot.answer_index.stats() if chatbot.answer_index is not None else None
+    if answer_index is not None:
+        print(f"Answer index: {answer_index['hit_rate']:.0%} of {answer_index['lookups']} lookups answered "
+              f"from {answer_index['intents']} intents")
+
+    if args.json:
+        results = {
+            "tiny": args.tiny, "inference_mode": args.inference_mode, "cache_size": args.cache_size,
+            "load_s": load_seconds, "peak_rss_mb": peak_mb,
+            "stages": stages, "categories": categories, "overall": overall, "throughput": throughput,
+            "prompt_cache": chatbot.prompt_cache.stats(), "answer_index": answer_index, "python": sys.version.split()[0],
+            "torch": torch.__version__,
+        }
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
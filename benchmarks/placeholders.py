@@ -0,0 +1,68 @@
+"""Compare the single-pass PlaceholderEngine with the old chain of str.replace calls.
+
+Times both on typical responses (one or two placeholders) with the current static
+templates and with the template table scaled up, since the replace chain costs one
+full scan of the response per template.
+
+    python -m benchmarks.placeholders --repeats 2000
+"""
+import argparse
+import time
+
+from pipeline import static_placeholders
+from placeholders import PlaceholderEngine
+
+RESPONSES = [
+    "To cancel your ticket for {{EVENT}} in {{CITY}}, open the {{CANCEL_TICKET_SECTION}} and select "
+    "{{CANCEL_TICKET_OPTION}}. If you need more help, reach out to our {{SUPPORT_TEAM_LINK}}.",
+    "You can request a refund from the {{REFUND_SECTION}} on our {{WEBSITE_URL}}. Refunds are usually "
+    "processed within a few business days, depending on your payment method.",
+    "I understand you'd like to sell your ticket. Please log in, go to {{SELL_TICKET_OPTION}} and follow "
+    "the prompts. Our customer service team is available if you run into any issues along the way.",
+]
+DYNAMIC = {"{{EVENT}}": "<b>Concert</b>", "{{CITY}}": "<b>Hyderabad</b>"}
+
+
+def replace_chain(response, dynamic_placeholders, templates):
+    # The previous implementation
+    for placeholder, value in templates.items():
+        response = response.replace(placeholder, value)
+    for placeholder, value in dynamic_placeholders.items():
+        response = response.replace(placeholder, value)
+    return response
+
+
+def scaled_templates(factor: int):
+    templates = dict(static_placeholders)
+    for i in range(1, factor):
+        templates.update({f"{key[:-2]}_{i}}}}}": value for key, value in static_placeholders.items()})
+    return templates
+
+
+def time_per_call(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for response in RESPONSES:
+            fn(response)
+    return (time.perf_counter() - start) * 1e6 / (repeats * len(RESPONSES))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=1000)
+    parser.add_argument("--scales", default="1,10", help="template table sizes as multiples of the current one")
+    args = parser.parse_args()
+
+    for factor in [int(f) for f in args.scales.split(",")]:
+        templates = scaled_templates(factor)
+        engine = PlaceholderEngine(templates)
+        for response in RESPONSES:
+            assert engine.substitute(response, DYNAMIC) == replace_chain(response, DYNAMIC, templates)
+        chain_us = time_per_call(lambda r: replace_chain(r, DYNAMIC, templates), args.repeats)
+        engine_us = time_per_call(lambda r: engine.substitute(r, DYNAMIC), args.repeats)
+        print(f"{len(templates):5d} templates   str.replace chain {chain_us:8.2f} us   "
+              f"engine {engine_us:8.2f} us   speedup {chain_us / engine_us:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
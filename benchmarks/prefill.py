@@ -0,0 +1,83 @@
+"""Measure DistilGPT2 prefill time with and without the prompt KV-cache.
+
+For each short ticketing question it times time-to-first-token (generate with
+max_new_tokens=1) in three ways:
+  cold    - no cache, the whole prompt is prefilled
+  prefix  - the constant "Instruction:" prefix comes from the cache
+  repeat  - the same prompt was seen before, only its last token is prefilled
+
+    python -m benchmarks.prefill --repeats 20
+    python -m benchmarks.prefill --tiny    # random stand-in model, no download
+"""
+import argparse
+import statistics
+import time
+
+import torch
+
+QUESTIONS = [
+    "How do I buy a ticket?", "How do I get a refund?", "What is the ticket cancellation fee?",
+    "How can I sell my ticket?", "How do I contact customer service?", "How can I transfer my ticket?",
+    "How can I upgrade my ticket?", "Where is my refund?",
+]
+
+
+def time_first_token(model, tokenizer, inputs, prompt_cache=None):
+    # The cache lookup (a copy of the cached key/values) counts towards the time
+    start = time.perf_counter()
+    past_key_values = prompt_cache.lookup(inputs["input_ids"])[0] if prompt_cache is not None else None
+    with torch.no_grad():
+        outputs = model.generate(
+            **inputs, max_new_tokens=1, do_sample=False, pad_token_id=tokenizer.eos_token_id,
+            past_key_values=past_key_values, return_dict_in_generate=True
+        )
+    elapsed = (time.perf_counter() - start) * 1000.0
+    if prompt_cache is not None:
+        prompt_cache.store(inputs["input_ids"], outputs.past_key_values)
+    return elapsed
+
+
+def run(model, tokenizer, repeats):
+    from prompt_cache import PromptCache
+
+    device = next(model.parameters()).device
+    timings = {"cold": [], "prefix": [], "repeat": []}
+    prompt_tokens = []
+    for question in QUESTIONS:
+        inputs = tokenizer(f"Instruction: {question} Response:", return_tensors="pt").to(device)
+        prompt_tokens.append(inputs["input_ids"].shape[1])
+        time_first_token(model, tokenizer, inputs) # Warm-up
+        for _ in range(repeats):
+            timings["cold"].append(time_first_token(model, tokenizer, inputs))
+            # Fresh cache each time: only the constant prefix is available
+            prefix_only = PromptCache(model, tokenizer, maxsize=0)
+            timings["prefix"].append(time_first_token(model, tokenizer, inputs, prefix_only))
+            repeat_cache = PromptCache(model, tokenizer)
+            time_first_token(model, tokenizer, inputs, repeat_cache)
+            timings["repeat"].append(time_first_token(model, tokenizer, inputs, repeat_cache))
+
+    print(f"{len(QUESTIONS)} questions, {statistics.fmean(prompt_tokens):.1f} prompt tokens on average, "
+          f"{repeats} repeats each")
+    cold = statistics.median(timings["cold"])
+    for name, values in timings.items():
+        median = statistics.median(values)
+        print(f"{name:<8} TTFT p50 {median:8.2f} ms   saved vs cold {100.0 * (1 - median / cold):5.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--tiny", action="store_true", help="use a tiny random stand-in model (no download)")
+    args = parser.parse_args()
+
+    if args.tiny:
+        from benchmarks.tiny_models import tiny_gpt2, tiny_tokenizer
+        model, tokenizer = tiny_gpt2(tiny_tokenizer())
+    else:
+        from pipeline import load_gpt2_model_and_tokenizer
+        model, tokenizer = load_gpt2_model_and_tokenizer()
+    run(model, tokenizer, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
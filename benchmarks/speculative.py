@@ -0,0 +1,135 @@
+"""Tokens per second and output equivalence of speculative decoding with an n-gram draft.
+
+Answers ticketing questions with DistilGPT2 in three ways:
+  standard    - model.generate, one forward pass per token
+  ngram-cold  - speculative_generate with an empty draft corpus (prompt lookup only)
+  ngram-warm  - the draft corpus first holds the answers to the UI's example queries,
+                i.e. past responses to related questions
+Greedy decoding is used so every answer can be compared token for token with generate().
+With --sample the standard and warm runs are repeated with the app's sampling settings
+(same output distribution, so only speed and acceptance are compared).
+
+    python -m benchmarks.speculative
+    python -m benchmarks.speculative --tiny --draft-tokens 4
+"""
+import argparse
+import time
+
+import torch
+
+from benchmarks.load_test import print_table
+from pipeline import ChatbotPipeline, example_queries
+from speculative import NgramDraft, speculative_generate
+
+# Paraphrases of the example queries, plus a few the corpus has no close match for
+QUESTIONS = [
+    "How can I buy a ticket?", "How do I upgrade my ticket?", "How can I change the name on my ticket?",
+    "Where can I find upcoming events?", "How can I reach customer service?", "How can I get a refund?",
+    "What is the fee for cancelling a ticket?", "How do I check my cancellation status?",
+    "How do I sell my ticket?", "Can I transfer my ticket to a friend?", "Where is my refund?",
+    "How do I print my ticket?",
+]
+
+
+def prompt_ids(tokenizer, question, device):
+    return tokenizer(f"Instruction: {question} Response:", return_tensors="pt")["input_ids"].to(device)
+
+
+def generate(model, tokenizer, input_ids, max_length, draft=None, do_sample=False):
+    # New token ids and seconds for one answer
+    start = time.perf_counter()
+    with torch.no_grad():
+        if draft is not None:
+            sequences = speculative_generate(
+                model, input_ids, draft, max_length, tokenizer.eos_token_id, do_sample=do_sample
+            ).sequences
+        elif do_sample:
+            sequences = model.generate(
+                input_ids=input_ids, attention_mask=torch.ones_like(input_ids), max_length=max_length,
+                do_sample=True, temperature=0.5, top_p=0.95, pad_token_id=tokenizer.eos_token_id
+            )
+        else:
+            sequences = model.generate(
+                input_ids=input_ids, attention_mask=torch.ones_like(input_ids), max_length=max_length,
+                do_sample=False, pad_token_id=tokenizer.eos_token_id
+            )
+    return sequences[0, input_ids.shape[1]:].tolist(), time.perf_counter() - start
+
+
+def run(model, tokenizer, mode, max_length, draft_tokens, reference=None, do_sample=False):
+    device = next(model.parameters()).device
+    draft = None
+    if mode == "ngram-warm":
+        draft = NgramDraft(max_draft=draft_tokens)
+        for question in example_queries:
+            input_ids = prompt_ids(tokenizer, question, device)
+            draft.add(input_ids[0].tolist() + generate(model, tokenizer, input_ids, max_length)[0])
+    tokens, seconds, identical, outputs = 0, 0.0, 0, []
+    drafted = accepted = steps = 0
+    for i, question in enumerate(QUESTIONS):
+        if mode == "ngram-cold":
+            draft = NgramDraft(max_draft=draft_tokens)
+        before = draft.stats() if draft is not None else None
+        new_tokens, elapsed = generate(
+            model, tokenizer, prompt_ids(tokenizer, question, device), max_length, draft, do_sample
+        )
+        if draft is not None:
+            after = draft.stats()
+            drafted += after["drafted_tokens"] - before["drafted_tokens"]
+            accepted += after["accepted_tokens"] - before["accepted_tokens"]
+            steps += after["steps"] - before["steps"]
+        tokens += len(new_tokens)
+        seconds += elapsed
+        outputs.append(new_tokens)
+        if reference is not None and new_tokens == reference[i]:
+            identical += 1
+    row = {
+        "mode": mode + (" (sampled)" if do_sample else ""),
+        "tokens": tokens,
+        "tokens_per_s": tokens / seconds,
+        "acceptance": accepted / drafted if drafted else 0.0,
+        "tokens_per_step": (accepted + steps) / steps if steps else 1.0,
+        "identical": f"{identical}/{len(QUESTIONS)}" if reference is not None and not do_sample else "-",
+    }
+    return row, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tiny", action="store_true", help="use a tiny random stand-in model (no downloads)")
+    parser.add_argument("--max-length", type=int, default=256)
+    parser.add_argument("--draft-tokens", type=int, default=8, help="longest draft verified per forward pass")
+    parser.add_argument("--sample", action="store_true", help="also compare sampled decoding")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    if args.tiny:
+        from benchmarks.tiny_models import tiny_pipeline
+        chatbot = tiny_pipeline(seed=args.seed)
+    else:
+        chatbot = ChatbotPipeline.from_pretrained()
+    model, tokenizer = chatbot.gpt2_model, chatbot.gpt2_tokenizer
+    device = next(model.parameters()).device
+    generate(model, tokenizer, prompt_ids(tokenizer, QUESTIONS[0], device), args.max_length) # Warm-up
+
+    baseline, reference = run(model, tokenizer, "standard", args.max_length, args.draft_tokens)
+    rows = [baseline]
+    for mode in ("ngram-cold", "ngram-warm"):
+        rows.append(run(model, tokenizer, mode, args.max_length, args.draft_tokens, reference)[0])
+    if args.sample:
+        torch.manual_seed(args.seed)
+        rows.append(run(model, tokenizer, "standard", args.max_length, args.draft_tokens, do_sample=True)[0])
+        torch.manual_seed(args.seed)
+        rows.append(run(model, tokenizer, "ngram-warm", args.max_length, args.draft_tokens, do_sample=True)[0])
+    for row in rows:
+        standard = baseline if "sampled" not in row["mode"] else rows[3]
+        row["speedup"] = row["tokens_per_s"] / standard["tokens_per_s"]
+
+    print(f"{len(QUESTIONS)} questions, max_length {args.max_length}, drafts of up to {args.draft_tokens} tokens")
+    print_table("Speculative decoding", rows,
+                ["mode", "tokens", "tokens_per_s", "speedup", "acceptance", "tokens_per_step", "identical"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Answer quality and length under the generation stopping criteria (stopping.py).
+
+Answers the example queries and a few paraphrases with DistilGPT2 under each setting:
+  reference  - only max_length and the restarted-template check
+  budget     - plus the token budget (CHATBOT_TOKEN_BUDGET, ...), as served by default
+  ngram      - plus the repeated n-gram check (--ngram-size, --max-repeats)
+Every setting samples each question from the same seed, so a stopped answer is a prefix of the
+reference one and the columns show only what the criteria cut: kept is the share of the
+reference text left, complete the share of answers ending in a full sentence, and
+lost_ph the reference placeholders missing from the answers.
+
+    python -m benchmarks.stopping
+    python -m benchmarks.stopping --tiny --verbose
+"""
+import argparse
+import time
+from collections import Counter
+
+import torch
+
+import stopping
+from benchmarks.load_test import percentile, print_table
+from benchmarks.speculative import QUESTIONS
+from pipeline import ChatbotPipeline, example_queries, generate_response
+from placeholders import PLACEHOLDER_PATTERN
+
+
+def answer_all(chatbot, questions, seed):
+    # [(response, new tokens, stop reason, seconds)]
+    answers = []
+    for i, question in enumerate(questions):
+        torch.manual_seed(seed + i)
+        info = {}
+        start = time.perf_counter()
+        response = generate_response(chatbot.gpt2_model, chatbot.gpt2_tokenizer, question, generation_info=info)
+        answers.append((response, info["new_tokens"], info["stop_reason"], time.perf_counter() - start))
+    return answers
+
+
+def summarize(setting, answers, reference):
+    tokens = [new_tokens for _, new_tokens, _, _ in answers]
+    kept = [
+        len(response) / len(ref) if ref else 1.0 for (response, *_), (ref, *_) in zip(answers, reference)
+    ]
+    lost = sum(
+        len(set(PLACEHOLDER_PATTERN.findall(ref)) - set(PLACEHOLDER_PATTERN.findall(response)))
+        for (response, *_), (ref, *_) in zip(answers, reference)
+    )
+    reasons = Counter(reason for _, _, reason, _ in answers)
+    return {
+        "setting": setting,
+        "mean_tokens": sum(tokens) / len(tokens),
+        "max_tokens": max(tokens),
+        "p95_ms": percentile([seconds * 1000 for *_, seconds in answers], 95),
+        "kept": sum(kept) / len(kept),
+        "complete": sum(bool(stopping.SENTENCE_END.search(r)) for r, *_ in answers) / len(answers),
+        "lost_ph": lost,
+        "stops": ", ".join(f"{reason} {n}" for reason, n in reasons.most_common()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tiny", action="store_true", help="use a tiny random stand-in model (no downloads)")
+    parser.add_argument("--ngram-size", type=int, default=4)
+    parser.add_argument("--max-repeats", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="print every answer the criteria shortened")
+    args = parser.parse_args()
+
+    if args.tiny:
+        from benchmarks.tiny_models import tiny_pipeline
+        chatbot = tiny_pipeline(seed=args.seed)
+    else:
+        chatbot = ChatbotPipeline.from_pretrained()
+    questions = list(example_queries) + [q for q in QUESTIONS if q not in example_queries]
+    stopping.GENERATION_DEADLINE = 0 # Wall-clock stops would make the settings incomparable
+    budget = (stopping.TOKEN_BUDGET_BASE, stopping.TOKENS_PER_PROMPT_TOKEN)
+    answer_all(chatbot, questions[:1], args.seed) # Warm-up
+
+    settings = {}
+    stopping.TOKEN_BUDGET_BASE, stopping.MAX_NGRAM_REPEATS = 10 ** 6, 0
+    settings["reference"] = answer_all(chatbot, questions, args.seed)
+    stopping.TOKEN_BUDGET_BASE, stopping.TOKENS_PER_PROMPT_TOKEN = budget
+    settings["budget"] = answer_all(chatbot, questions, args.seed)
+    stopping.REPEAT_NGRAM_SIZE, stopping.MAX_NGRAM_REPEATS = args.ngram_size, args.max_repeats
+    settings["ngram"] = answer_all(chatbot, questions, args.seed)
+
+    reference = settings["reference"]
+    rows = [summarize(setting, answers, reference) for setting, answers in settings.items()]
+    print(f"{len(questions)} questions; budget {budget[0]} + {budget[1]:g} per prompt token, "
+          f"n-grams of {args.ngram_size} seen {args.max_repeats} times")
+    print_table("Stopping criteria", rows,
+                ["setting", "mean_tokens", "max_tokens", "p95_ms", "kept", "complete", "lost_ph"])
+    for row in rows:
+        print(f"{row['setting']:<12} {row['stops']}")
+    if args.verbose:
+        for setting in ("budget", "ngram"):
+            for question, (response, _, reason, _), (ref, *_) in zip(questions, settings[setting], reference):
+                if response != ref:
+                    print(f"\n[{setting}: {reason}] {question}\n  answer:    {response}\n  reference: {ref}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Tiny randomly initialized stand-ins for the chatbot models.
+
+Each gets its own copy of one byte-level BPE tokenizer trained on a few
+ticketing sentences, as the real models have separate tokenizers (stages run
+side by side, and a fast tokenizer can't be used from two threads at once). They
+need no network or model downloads, so benchmarks can exercise every pipeline
+stage in CI. Latencies measure the pipeline's own overhead, not the real models.
+"""
+import copy
+import re
+
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import (
+    DistilBertConfig, DistilBertForSequenceClassification, GPT2Config, GPT2LMHeadModel,
+    PreTrainedTokenizerFast, T5Config, T5ForConditionalGeneration,
+)
+
+TOKENIZER_CORPUS = [
+    "Instruction: How do I get a refund? Response: Go to {{REFUND_SECTION}} on {{WEBSITE_URL}}.",
+    "How can I buy, sell, transfer, upgrade or cancel my ticket for the upcoming event in my city?",
+    "Contact customer service about the cancellation fee, payment options and personal details.",
+    "What's the weather like today? Tell me a joke about the concert, festival, show or match.",
+]
+EOS_TOKEN = "<|endoftext|>"
+
+
+def tiny_tokenizer(vocab_size: int = 512):
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab_size, special_tokens=[EOS_TOKEN], initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    )
+    tokenizer.train_from_iterator(TOKENIZER_CORPUS * 10, trainer)
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, eos_token=EOS_TOKEN, pad_token=EOS_TOKEN,
+        bos_token=EOS_TOKEN, unk_token=EOS_TOKEN
+    )
+
+
+def tiny_spell_corrector(tokenizer):
+    config = T5Config(
+        vocab_size=len(tokenizer), d_model=32, d_ff=64, num_layers=1, num_heads=2, d_kv=16,
+        decoder_start_token_id=tokenizer.pad_token_id, pad_token_id=tokenizer.pad_token_id,
+        eos_token_id=tokenizer.eos_token_id
+    )
+    model = T5ForConditionalGeneration(config)
+    # A random decoder would run to max_length every time; bias it to stop at once, so the
+    # corrector returns queries unchanged (correct_spelling_batch keeps the input on empty output)
+    with torch.no_grad():
+        model.lm_head.weight.zero_()
+        model.lm_head.bias = torch.nn.Parameter(torch.zeros(len(tokenizer)))
+        model.lm_head.bias[tokenizer.eos_token_id] = 10.0
+    return model.eval(), tokenizer
+
+
+def tiny_gpt2(tokenizer):
+    config = GPT2Config(
+        vocab_size=len(tokenizer), n_embd=32, n_layer=2, n_head=2, n_positions=512,
+        bos_token_id=tokenizer.eos_token_id, eos_token_id=tokenizer.eos_token_id
+    )
+    return GPT2LMHeadModel(config).eval(), tokenizer
+
+
+def tiny_classifier(tokenizer):
+    config = DistilBertConfig(
+        vocab_size=len(tokenizer), dim=32, hidden_dim=64, n_layers=1, n_heads=2, num_labels=2,
+        max_position_embeddings=512, pad_token_id=tokenizer.pad_token_id
+    )
+    return DistilBertForSequenceClassification(config).eval(), tokenizer
+
+
+class StubGliner:
+    # Stands in for GLiNER: tags the word after "in" as a city, so placeholders still get filled.
+    # Queries are lowercased by normalize_query before they get here.
+
+    CITY_PATTERN = re.compile(r"\bin (?!(?:my|the|a|an|your|advance)\b)([A-Za-z]+)")
+
+    def inference(self, texts, labels, threshold=0.5, batch_size=8, **kwargs):
+        return [
+            [{"start": m.start(1), "end": m.end(1), "text": m.group(1), "label": "city", "score": 0.9}
+             for m in self.CITY_PATTERN.finditer(text)]
+            for text in texts
+        ]
+
+    def predict_entities(self, text, labels, threshold=0.5, **kwargs):
+        return self.inference([text], labels, threshold)[0]
+
+
+def build_tiny_registry(seed: int = 0):
+    from model_store import ModelRegistry
+
+    torch.manual_seed(seed)
+    tokenizer = tiny_tokenizer()
+    spell_corrector = tiny_spell_corrector(copy.deepcopy(tokenizer))
+    gpt2 = tiny_gpt2(copy.deepcopy(tokenizer))
+    classifier = tiny_classifier(copy.deepcopy(tokenizer))
+    gliner = StubGliner()
+    return ModelRegistry({
+        "spell_corrector": lambda: spell_corrector,
+        "gliner": lambda: gliner,
+        "gpt2": lambda: gpt2,
+        "gpt2_tokenizer": lambda: tokenizer,
+        "classifier": lambda: classifier,
+    })
+
+
+def tiny_pipeline(seed: int = 0, **kwargs):
+    from pipeline import ChatbotPipeline
+
+    return ChatbotPipeline(models=build_tiny_registry(seed), **kwargs)
@@ -0,0 +1,96 @@
+"""Throughput and memory of the pre-fork WorkerPool against the number of workers.
+
+Loads the models once, then for each worker count forks a pool and sends the load-test
+corpus from concurrent client threads. 0 workers is the in-process BatchScheduler.
+Memory is reported as RSS summed over the parent and workers (which counts shared
+weight pages once per process) and as PSS (which splits them, so it sums correctly).
+
+    python -m benchmarks.workers --workers 0,1,2,4 --requests 64
+    python -m benchmarks.workers --tiny
+"""
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from backend import process_memory_mb
+from benchmarks.load_test import build_corpus, latency_summary, print_table
+from pipeline import ChatbotPipeline, example_queries
+from scheduler import BatchScheduler
+from workers import WorkerPool
+
+
+def drive(submit_answer, corpus, requests: int, concurrency: int):
+    queries = [corpus[i % len(corpus)][1] for i in range(requests)]
+
+    def timed(query):
+        start = time.perf_counter()
+        submit_answer(query)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(timed, queries))
+    return time.perf_counter() - start, latencies
+
+
+def run_level(chatbot, corpus, num_workers: int, requests: int, concurrency: int, threads: int):
+    if num_workers == 0:
+        runner = BatchScheduler(chatbot, max_queue_size=max(128, requests))
+        drive(runner.answer, corpus, len(corpus), concurrency) # Warm-up
+        wall, latencies = drive(runner.answer, corpus, requests, concurrency)
+        memory = [process_memory_mb()]
+        threads_used = torch.get_num_threads()
+    else:
+        runner = WorkerPool(chatbot, num_workers, threads_per_worker=threads, max_pending=max(128, requests))
+        runner.wait_ready()
+        drive(runner.answer, corpus, len(corpus), concurrency)
+        wall, latencies = drive(runner.answer, corpus, requests, concurrency)
+        stats = runner.stats()
+        memory = [stats["memory_mb"]["parent"]] + stats["memory_mb"]["workers"]
+        threads_used = runner.threads_per_worker
+    runner.shutdown()
+    row = {
+        "workers": num_workers, "threads": threads_used, "qps": requests / wall,
+        "rss_total_mb": sum(m["rss"] for m in memory), "pss_total_mb": sum(m["pss"] for m in memory),
+    }
+    row.update(latency_summary(latencies))
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tiny", action="store_true", help="use tiny random stand-in models (no downloads)")
+    parser.add_argument("--workers", default="0,1,2,4", help="comma-separated worker counts (0 = in-process)")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="torch threads per worker (default: cores / workers)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    random.seed(args.seed)
+    if args.tiny:
+        from benchmarks.tiny_models import tiny_pipeline
+        chatbot = tiny_pipeline(seed=args.seed, cache_size=0)
+    else:
+        chatbot = ChatbotPipeline.from_pretrained(cache_size=0)
+    chatbot.preload()
+    chatbot.answer(example_queries[0])
+    corpus = build_corpus(chatbot.gpt2_tokenizer, chatbot.max_tokens, args.seed)
+
+    rows = [
+        run_level(chatbot, corpus, int(level), args.requests, args.concurrency, args.threads)
+        for level in args.workers.split(",") if level.strip()
+    ]
+    print(f"{os.cpu_count()} cores, {args.requests} requests from {args.concurrency} client threads, answer cache off")
+    print_table("Throughput and memory by worker count", rows,
+                ["workers", "threads", "qps", "p50_ms", "p95_ms", "rss_total_mb", "pss_total_mb"])
+
+
+if __name__ == "__main__":
+    main()
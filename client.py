@@ -0,0 +1,89 @@
+import json
+import urllib.error
+import urllib.request
+
+from scheduler import SchedulerBusy
+
+# =============================
+# SERVICE CLIENT
+# =============================
+
+UNAVAILABLE_MESSAGE = "⚠️ The assistant is unavailable right now. Please try again in a moment."
+
+
+class ServiceUnavailable(SchedulerBusy):
+    # The service could not be reached; handled wherever a busy scheduler is
+    pass
+
+
+class ChatbotClient:
+    # Blocking client for server.py, so the Streamlit app can run without loading any models
+
+    def __init__(self, base_url: str, timeout: float = 120.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _open(self, path: str, payload=None, accept: str = "application/json"):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        request = urllib.request.Request(
+            self.base_url + path, data=data,
+            headers={"Content-Type": "application/json", "Accept": accept}
+        )
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error") or str(e)
+            except ValueError:
+                message = str(e)
+            if e.code == 503:
+                raise SchedulerBusy(message)
+            raise RuntimeError(f"Chatbot service error {e.code}: {message}")
+        except (urllib.error.URLError, OSError) as e:
+            print(f"Chatbot service unreachable: {e}")
+            raise ServiceUnavailable(UNAVAILABLE_MESSAGE)
+
+    def _request(self, path: str, payload=None):
+        with self._open(path, payload) as response:
+            return json.loads(response.read())
+
+    def health(self):
+        try:
+            return self._request("/health")
+        except SchedulerBusy as e:
+            return {"status": "loading", "error": str(e)}
+
+    def classify(self, query: str):
+        return self._request("/classify", {"query": query})
+
+    def validate(self, query: str):
+        # (processed query, error message), like BatchScheduler.validate
+        result = self.classify(query)
+        return result["processed_query"], result["error"]
+
+    def answer(self, query: str):
+        return self._request("/answer", {"query": query})
+
+    def stream_events(self, query: str):
+        # (event, payload) pairs from the /answer server-sent event stream
+        with self._open("/answer", {"query": query, "stream": True}, accept="text/event-stream") as response:
+            event, data = "message", []
+            for raw_line in response:
+                line = raw_line.decode("utf-8").rstrip("\r\n")
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data.append(line[len("data:"):].strip())
+                elif not line and data:
+                    yield event, json.loads("\n".join(data))
+                    event, data = "message", []
+
+    def stream_answer(self, query: str):
+        # Response text chunks as the service generates them
+        for event, payload in self.stream_events(query):
+            if event == "token":
+                yield payload["text"]
+            elif event == "error":
+                raise SchedulerBusy(payload["error"])
+            elif event == "done" and payload.get("error"):
+                yield payload["response"]
@@ -0,0 +1,262 @@
+import json
+import os
+import random
+
+import torch
+from safetensors.torch import load_file, save_file
+from torch import nn
+
+from retrieval import pool_embeddings
+
+# =============================
+# FUSED OOD + ENTITY FRONT END
+# =============================
+
+# "separate" runs the DistilBERT classifier and GLiNER; "fused" gets the OOD verdict, the entity
+# spans and the retrieval embedding from one pass of the classifier's DistilBERT encoder
+FRONTEND_MODES = ("separate", "fused")
+FRONTEND_MODE = os.environ.get("CHATBOT_FRONTEND", "separate")
+# Directory written by `python frontend.py --out <dir>`; fused mode needs it
+ENTITY_HEAD_DIR = os.environ.get("CHATBOT_ENTITY_HEAD")
+HEAD_WEIGHTS_FILE = "entity_head.safetensors"
+HEAD_CONFIG_FILE = "entity_head.json"
+
+# Distillation corpus: GLiNER labels these questions and the entity head learns to match it
+EVENTS = [
+    "concert", "music festival", "football match", "comedy show", "theatre play", "cricket game",
+    "jazz night", "food festival", "basketball game", "opera",
+]
+CITIES = [
+    "Hyderabad", "Mumbai", "London", "New York", "Paris", "Berlin", "Chennai", "Toronto", "Sydney",
+    "Madrid", "Bangalore", "Chicago",
+]
+TEMPLATES = [
+    "How can I upgrade my ticket for the upcoming {event} in {city}?",
+    "How do I get a refund for the {event} in {city}?",
+    "Can I transfer my {event} ticket in {city} to a friend?",
+    "How do I cancel my ticket for the {event}?",
+    "Are there tickets left for the {event} in {city}?",
+    "How can I sell my ticket to the {event} in {city}?",
+    "Where do I pick up my tickets in {city}?",
+    "When does the {event} start?",
+    "What is the cancellation fee for the {event} in {city}?",
+    "I bought tickets for the {event} in {city}, how do I change my seat?",
+]
+
+
+def distillation_queries(events=EVENTS, cities=CITIES, templates=TEMPLATES, extra=(), limit: int = 600,
+                         seed: int = 0):
+    # Every template with every event and city (sampled down to limit), plus extra entity-free questions
+    queries = sorted({
+        template.format(event=event, city=city) for template in templates for event in events for city in cities
+    })
+    random.Random(seed).shuffle(queries)
+    return queries[:limit] + list(extra)
+
+
+class EntityHead(nn.Module):
+    # Per-token BIO tags over the encoder's hidden states: "O", then B-/I- for each label
+
+    def __init__(self, hidden_size: int, labels):
+        super().__init__()
+        self.labels = list(labels)
+        self.tags = ["O"] + [f"{prefix}-{label}" for label in self.labels for prefix in ("B", "I")]
+        self.proj = nn.Linear(hidden_size, len(self.tags))
+
+    def forward(self, hidden):
+        return self.proj(hidden)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        save_file({k: v.contiguous() for k, v in self.state_dict().items()}, os.path.join(path, HEAD_WEIGHTS_FILE))
+        with open(os.path.join(path, HEAD_CONFIG_FILE), "w", encoding="utf-8") as f:
+            json.dump({"hidden_size": self.proj.in_features, "labels": self.labels}, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(os.path.join(path, HEAD_CONFIG_FILE), encoding="utf-8") as f:
+            config = json.load(f)
+        head = cls(config["hidden_size"], config["labels"])
+        head.load_state_dict(load_file(os.path.join(path, HEAD_WEIGHTS_FILE)))
+        return head.eval()
+
+
+def classifier_logits(model, hidden):
+    # DistilBertForSequenceClassification's head, applied to hidden states computed elsewhere
+    pooled = model.pre_classifier(hidden[:, 0])
+    return model.classifier(model.dropout(nn.functional.relu(pooled)))
+
+
+def encode(model, tokenizer, queries):
+    # (hidden states, attention mask, character offsets) from one encoder pass over a batch
+    device = next(model.parameters()).device
+    inputs = tokenizer(
+        list(queries), return_tensors="pt", truncation=True, padding=True, max_length=256,
+        return_offsets_mapping=True
+    )
+    offsets = inputs.pop("offset_mapping").tolist()
+    inputs = {k: v.to(device) for k, v in inputs.items() if k in ("input_ids", "attention_mask")}
+    with torch.no_grad():
+        hidden = model.base_model(**inputs).last_hidden_state
+    return hidden, inputs["attention_mask"], offsets
+
+
+def decode_spans(text, tag_probs, offsets, labels, threshold: float):
+    # GLiNER-style entity dicts from one query's tag probabilities; a span's score is the mean
+    # probability of its tokens' tags
+    spans = []
+    current = None
+
+    def close():
+        if current is not None:
+            score = sum(current["probs"]) / len(current["probs"])
+            span_text = text[current["start"]:current["end"]]
+            stripped = span_text.strip()
+            if score >= threshold and stripped:
+                start = current["start"] + len(span_text) - len(span_text.lstrip())
+                spans.append({
+                    "start": start, "end": start + len(stripped), "text": stripped,
+                    "label": labels[current["label"]], "score": score
+                })
+
+    probs, tags = tag_probs.max(dim=-1)
+    for prob, tag, (start, end) in zip(probs.tolist(), tags.tolist(), offsets):
+        if start == end or tag == 0: # Special/padding token, or outside any entity
+            close()
+            current = None
+            continue
+        label, inside = (tag - 1) // 2, (tag - 1) % 2 == 1
+        if inside and current is not None and current["label"] == label:
+            current["end"] = end
+            current["probs"].append(prob)
+        else:
+            close()
+            current = {"start": start, "end": end, "label": label, "probs": [prob]}
+    close()
+    return spans
+
+
+class FusedFrontEnd:
+    # One pass of the classifier's DistilBERT encoder per batch. The classifier's own head on the
+    # [CLS] state gives is_ood's verdict, the EntityHead tags entity tokens in the same hidden
+    # states, and mean pooling gives the retrieval embedding. Entities with a label outside
+    # labels, or scoring under threshold, are dropped, as GLiNER would drop them.
+
+    def __init__(self, model, tokenizer, head: EntityHead, labels=None, threshold: float = 0.4):
+        if not hasattr(model, "pre_classifier") or getattr(model, "base_model", None) is None:
+            raise ValueError("The fused front end needs the DistilBERT classifier's encoder (not torchscript mode)")
+        self.model = model
+        self.tokenizer = tokenizer
+        self.head = head.to(next(model.parameters()).device)
+        self.labels = set(labels) if labels is not None else set(head.labels)
+        self.threshold = threshold
+
+    def run(self, queries):
+        # {"is_ood", "entities", "embedding"} per query
+        queries = list(queries)
+        if not queries:
+            return []
+        hidden, attention_mask, offsets = encode(self.model, self.tokenizer, queries)
+        with torch.no_grad():
+            ood_flags = (classifier_logits(self.model, hidden).argmax(dim=1) == 1).tolist()
+            tag_probs = self.head(hidden.float()).softmax(dim=-1).cpu()
+        embeddings = pool_embeddings(hidden, attention_mask)
+        results = []
+        for i, query in enumerate(queries):
+            entities = [
+                entity for entity in decode_spans(query, tag_probs[i], offsets[i], self.head.labels, self.threshold)
+                if entity["label"] in self.labels
+            ]
+            results.append({"is_ood": ood_flags[i], "entities": entities, "embedding": embeddings[i]})
+        return results
+
+
+def teacher_entities(gliner_model, queries, labels, threshold: float, batch_size: int = 32):
+    entities = []
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        entities.extend(gliner_model.inference(batch, labels, threshold=threshold, batch_size=len(batch)))
+    return entities
+
+
+def tag_tokens(offsets, entities, labels):
+    # BIO tag index per token from character spans; special/padding tokens get -100 (ignored)
+    index = {label: i for i, label in enumerate(labels)}
+    tags = []
+    for start, end in offsets:
+        if start == end:
+            tags.append(-100)
+            continue
+        tag = 0
+        for entity in entities:
+            if entity["label"] in index and start < entity["end"] and end > entity["start"]:
+                begins = start <= entity["start"]
+                tag = 1 + 2 * index[entity["label"]] + (0 if begins else 1)
+                break
+        tags.append(tag)
+    return tags
+
+
+def train_entity_head(model, tokenizer, queries, entities, labels, epochs: int = 500, lr: float = 1e-2,
+                      batch_size: int = 64, seed: int = 0):
+    # Fits a linear tagger on the frozen encoder, so the classifier (and its OOD verdicts) is untouched.
+    # Hidden states are computed once; training then only touches the head.
+    torch.manual_seed(seed)
+    features, targets = [], []
+    for start in range(0, len(queries), batch_size):
+        hidden, _, offsets = encode(model, tokenizer, queries[start:start + batch_size])
+        for i, query_offsets in enumerate(offsets):
+            tags = torch.tensor(tag_tokens(query_offsets, entities[start + i], labels))
+            keep = tags != -100
+            features.append(hidden[i, :len(tags)][keep].float().cpu())
+            targets.append(tags[keep])
+    features, targets = torch.cat(features), torch.cat(targets)
+    head = EntityHead(features.shape[1], labels)
+    optimizer = torch.optim.Adam(head.parameters(), lr=lr)
+    for _ in range(epochs):
+        optimizer.zero_grad()
+        loss = nn.functional.cross_entropy(head(features), targets)
+        loss.backward()
+        optimizer.step()
+    with torch.no_grad():
+        accuracy = (head(features).argmax(dim=-1) == targets).float().mean().item()
+    return head.eval(), {"tokens": len(targets), "loss": loss.item(), "token_accuracy": accuracy}
+
+
+if __name__ == "__main__":
+    # Distill the entity head from GLiNER, then set CHATBOT_FRONTEND=fused CHATBOT_ENTITY_HEAD=<dir>:
+    #   python frontend.py --out entity_head
+    #   python frontend.py --out entity_head --queries queries.txt   # one question per line
+    import argparse
+
+    import pipeline
+    from retrieval import INTENTS
+
+    parser = argparse.ArgumentParser(description="Train the fused front end's entity head from GLiNER")
+    parser.add_argument("--out", required=True, help="directory to write the head to")
+    parser.add_argument("--queries", help="text file of questions, one per line (default: built-in templates)")
+    parser.add_argument("--epochs", type=int, default=500)
+    parser.add_argument("--tiny", action="store_true", help="use tiny random stand-in models (no downloads)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        intent_questions = [q for spec in INTENTS.values() for q in spec["questions"]]
+        queries = distillation_queries(extra=intent_questions + pipeline.example_queries, seed=args.seed)
+    queries = [pipeline.normalize_query(query) for query in queries]
+    if args.tiny:
+        from benchmarks.tiny_models import tiny_pipeline
+        chatbot = tiny_pipeline(seed=args.seed)
+    else:
+        chatbot = pipeline.ChatbotPipeline.from_pretrained()
+    entities = teacher_entities(chatbot.gliner_model, queries, pipeline.GLINER_LABELS, pipeline.GLINER_THRESHOLD)
+    head, report = train_entity_head(
+        chatbot.clf_model, chatbot.clf_tokenizer, queries, entities, pipeline.GLINER_LABELS,
+        epochs=args.epochs, seed=args.seed
+    )
+    head.save(args.out)
+    print(f"{len(queries)} questions, {sum(len(e) for e in entities)} GLiNER entities, {report['tokens']} tokens")
+    print(f"Final loss {report['loss']:.4f}, token tag accuracy {report['token_accuracy']:.1%}; written to {args.out}")
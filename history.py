@@ -0,0 +1,123 @@
+import itertools
+import json
+import os
+import time
+import uuid
+from collections import deque
+
+# =============================
+# CHAT HISTORY
+# =============================
+
+AVATARS = {"user": "👤", "assistant": "🤖"}
+
+
+class ChatMessage:
+    # One turn; the avatar comes from the role instead of being stored per message
+    __slots__ = ("role", "content", "processed_content")
+
+    def __init__(self, role: str, content: str, processed_content: str = None):
+        self.role = role
+        self.content = content
+        self.processed_content = processed_content
+
+    @property
+    def avatar(self):
+        return AVATARS[self.role]
+
+    def to_dict(self):
+        return {"role": self.role, "content": self.content, "processed_content": self.processed_content}
+
+
+class ChatHistory:
+    # Keeps the newest max_messages turns in memory. Older turns are appended to a JSON-lines
+    # file in archive_dir when one is given, and dropped otherwise. window(n) returns the
+    # newest n turns, reading the archive only when n reaches past what is in memory.
+    # Archives untouched for archive_ttl seconds (sessions that ended without clearing) are
+    # deleted whenever a session starts a new one, so the directory doesn't grow without limit.
+
+    def __init__(self, max_messages: int = 200, archive_dir: str = None, archive_ttl: float = 24 * 3600):
+        self.max_messages = max_messages
+        self.archive_dir = archive_dir
+        self.archive_ttl = archive_ttl
+        self.archive_path = None
+        self._messages = deque()
+        self._archived = 0 # Turns moved out of memory (spilled or dropped)
+
+    def append(self, role: str, content: str, processed_content: str = None):
+        message = ChatMessage(role, content, processed_content)
+        self._messages.append(message)
+        while len(self._messages) > self.max_messages:
+            self._spill(self._messages.popleft())
+        return message
+
+    def _spill(self, message):
+        self._archived += 1
+        if self.archive_dir is None:
+            return
+        if self.archive_path is None:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            self._remove_stale_archives()
+            self.archive_path = os.path.join(self.archive_dir, f"chat-{uuid.uuid4().hex}.jsonl")
+        try:
+            with open(self.archive_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(message.to_dict()) + "\n")
+        except OSError as e:
+            print(f"Chat history archive error: {e}")
+
+    def _remove_stale_archives(self):
+        # An active session appends on every spill, which keeps its archive's mtime fresh
+        cutoff = time.time() - self.archive_ttl
+        try:
+            entries = list(os.scandir(self.archive_dir))
+        except OSError as e:
+            print(f"Chat history archive error: {e}")
+            return
+        for entry in entries:
+            if not (entry.name.startswith("chat-") and entry.name.endswith(".jsonl")):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass # Removed by another session
+
+    def _read_archive(self, start: int, stop: int):
+        if self.archive_path is None or start >= stop:
+            return []
+        try:
+            with open(self.archive_path, encoding="utf-8") as f:
+                return [ChatMessage(**json.loads(line)) for line in itertools.islice(f, start, stop)]
+        except OSError as e:
+            print(f"Chat history archive error: {e}")
+            return []
+
+    def available(self):
+        # Turns that can still be shown: in memory, plus archived ones if they were spilled to disk
+        return len(self._messages) + (self._archived if self.archive_path is not None else 0)
+
+    def window(self, count: int):
+        in_memory = len(self._messages)
+        if count <= in_memory:
+            return list(itertools.islice(self._messages, in_memory - count, None))
+        from_archive = min(count - in_memory, self.available() - in_memory)
+        return self._read_archive(self._archived - from_archive, self._archived) + list(self._messages)
+
+    def has_earlier(self, count: int):
+        return self.available() > count
+
+    def last(self):
+        return self._messages[-1] if self._messages else None
+
+    def clear(self):
+        self._messages.clear()
+        self._archived = 0
+        if self.archive_path is not None:
+            try:
+                os.remove(self.archive_path)
+            except OSError:
+                pass
+            self.archive_path = None
+
+    def __len__(self):
+        return self._archived + len(self._messages)
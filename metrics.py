@@ -0,0 +1,228 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# =============================
+# HISTOGRAMS AND COUNTERS
+# =============================
+
+# Latency buckets in seconds, from a cached lookup up to a long DistilGPT2 generation
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (8, 16, 32, 64, 96, 128, 192, 256)
+
+METRIC_HELP = {
+    "chatbot_stage_seconds": ("histogram", "Time spent in each pipeline stage per call"),
+    "chatbot_time_to_first_token_seconds": ("histogram", "Time from request to the first streamed response text"),
+    "chatbot_generated_tokens": ("histogram", "Tokens generated by DistilGPT2 per response"),
+    "chatbot_queries_total": ("counter", "Queries by outcome (ood, in_domain, too_long)"),
+    "chatbot_stage_skipped_total": ("counter", "Items that skipped a stage"),
+    "chatbot_errors_total": ("counter", "Errors swallowed by a stage"),
+    "chatbot_generation_stops_total": ("counter", "Why DistilGPT2 stopped generating (eos, max_length or a stopping criterion)"),
+    "chatbot_retrieval_total": ("counter", "Answer index lookups that returned a stored answer (hit) or fell back to generation (miss)"),
+    "chatbot_draft_tokens_total": ("counter", "Speculatively drafted tokens, accepted or rejected by DistilGPT2"),
+    "chatbot_critical_path_seconds": ("histogram", "Time along the longest chain of dependent stages per run of a stage graph"),
+    "chatbot_critical_path_stage_seconds": ("histogram", "Time each stage on a run's critical path contributed to it"),
+    "chatbot_stage_overlap_seconds": ("histogram", "Stage time per run hidden by running alongside the critical path"),
+    "chatbot_worker_batch_seconds": ("histogram", "Time a worker process spent on one batch, per stage"),
+    "chatbot_unknown_placeholders_total": ("counter", "{{...}} placeholders in responses with no mapped value"),
+}
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1) # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float):
+        # Upper bound of the bucket holding the q-th observation (what Prometheus would estimate at most)
+        if self.count == 0:
+            return 0.0
+        rank = math.ceil(q * self.count)
+        seen = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == math.inf else repr(float(bound))
+
+
+class MetricsRegistry:
+    # Labelled histograms and counters, rendered in the Prometheus text exposition format
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {} # name -> {labels tuple: Histogram}
+        self._counters = {}   # name -> {labels tuple: float}
+        self._buckets = {"chatbot_generated_tokens": TOKEN_BUCKETS}
+        # forward(kind, name, value, labels), if set, receives every observe()/inc() instead of this
+        # registry, e.g. in a forked worker, which sends them to the parent serving /metrics
+        self.forward = None
+
+    def observe(self, name: str, value: float, **labels):
+        if self.forward is not None:
+            self.forward("observe", name, value, labels)
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(self._buckets.get(name, DEFAULT_BUCKETS))
+            series[key].observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        if self.forward is not None:
+            self.forward("inc", name, amount, labels)
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def counter_values(self, name: str):
+        # {comma-joined label values: count}
+        with self._lock:
+            return {",".join(str(v) for _, v in key): value for key, value in self._counters.get(name, {}).items()}
+
+    def summary(self, name: str, quantiles=(0.5, 0.95, 0.99)):
+        # {first label value: {"count", "mean", "p50", ...}} for the in-app debug panel
+        with self._lock:
+            series = dict(self._histograms.get(name, {}))
+            rows = {}
+            for key, hist in series.items():
+                label = key[0][1] if key else ""
+                row = {"count": hist.count, "mean": hist.sum / hist.count if hist.count else 0.0}
+                for q in quantiles:
+                    row[f"p{int(q * 100)}"] = hist.quantile(q)
+                rows[label] = row
+        return rows
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            names = sorted(set(self._histograms) | set(self._counters))
+            for name in names:
+                kind, help_text = METRIC_HELP.get(
+                    name, ("histogram" if name in self._histograms else "counter", name)
+                )
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, hist in sorted(self._histograms.get(name, {}).items()):
+                    cumulative = 0
+                    for bound, count in zip(hist.buckets + (math.inf,), hist.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, {'le': _format_bound(bound)})} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {hist.sum}")
+                    lines.append(f"{name}_count{_format_labels(key)} {hist.count}")
+                for key, value in sorted(self._counters.get(name, {}).items()):
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+# Process-wide registry shared by every pipeline, scheduler and the /metrics endpoint
+METRICS = MetricsRegistry()
+
+# =============================
+# PER-STAGE COUNTERS
+# =============================
+
+class StageStats:
+    # Thread-safe call/item/time counters per pipeline stage, plus how many items skipped a stage.
+    # Every timed call is also recorded in the chatbot_stage_seconds histogram.
+
+    def __init__(self, registry: MetricsRegistry = METRICS):
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def _stage(self, stage: str):
+        if stage not in self._stages:
+            self._stages[stage] = {"calls": 0, "items": 0, "skipped": 0, "seconds": 0.0}
+        return self._stages[stage]
+
+    def record(self, stage: str, seconds: float, items: int = 1):
+        with self._lock:
+            entry = self._stage(stage)
+            entry["calls"] += 1
+            entry["items"] += items
+            entry["seconds"] += seconds
+        self.registry.observe("chatbot_stage_seconds", seconds, stage=stage)
+
+    @contextmanager
+    def timer(self, stage: str, items: int = 1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, items)
+
+    def skip(self, stage: str, items: int = 1):
+        if items <= 0:
+            return
+        with self._lock:
+            self._stage(stage)["skipped"] += items
+        self.registry.inc("chatbot_stage_skipped_total", items, stage=stage)
+
+    def snapshot(self):
+        with self._lock:
+            stages = {stage: dict(entry) for stage, entry in self._stages.items()}
+        for entry in stages.values():
+            seen = entry["items"] + entry["skipped"]
+            entry["skip_rate"] = entry["skipped"] / seen if seen else 0.0
+            entry["avg_ms_per_item"] = 1000.0 * entry["seconds"] / entry["items"] if entry["items"] else 0.0
+        return stages
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+# =============================
+# PROMETHEUS ENDPOINT
+# =============================
+
+def start_metrics_server(port: int, host: str = "127.0.0.1", registry: MetricsRegistry = METRICS):
+    # Serves GET /metrics from a daemon thread; returns the server so callers can shut it down
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # Scrapes every few seconds would flood the Streamlit log
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
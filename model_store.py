@@ -0,0 +1,138 @@
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# =============================
+# LOCAL MODEL STORE
+# =============================
+
+# Directory holding safetensors copies of every model; unset means load from the Hub / HF cache
+MODEL_STORE_ENV = "CHATBOT_MODEL_STORE"
+_READY_MARKER = ".complete"
+
+
+def model_store_dir():
+    return os.environ.get(MODEL_STORE_ENV) or None
+
+
+def local_model_path(model_id: str, store_dir=None):
+    store_dir = store_dir or model_store_dir()
+    if store_dir is None:
+        return None
+    return os.path.join(store_dir, model_id.replace("/", "--"))
+
+
+def resolve_model_source(model_id: str):
+    # (path or Hub id, from_pretrained kwargs): stored copies load offline and memory-mapped
+    path = local_model_path(model_id)
+    if path is not None and os.path.exists(os.path.join(path, _READY_MARKER)):
+        return path, {"local_files_only": True}
+    return model_id, {}
+
+
+def persist_model(model_id: str, model, tokenizer=None):
+    # Save a freshly downloaded model into the store; written to a temp dir and renamed so
+    # concurrent workers never see a half-written copy
+    path = local_model_path(model_id)
+    if path is None or os.path.exists(os.path.join(path, _READY_MARKER)):
+        return
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    try:
+        if hasattr(model, "data_processor"):
+            # GLiNER saves its own tokenizer and defaults to pickle weights
+            model.save_pretrained(tmp_path, safe_serialization=True)
+        else:
+            model.save_pretrained(tmp_path) # transformers always writes safetensors
+            if tokenizer is not None:
+                tokenizer.save_pretrained(tmp_path)
+        open(os.path.join(tmp_path, _READY_MARKER), "w").close()
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"Could not save {model_id} to the model store: {e}")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+# =============================
+# LAZY MODEL REGISTRY
+# =============================
+
+class ModelRegistry:
+    # Named loaders that run at most once, on first get() or on preload(). Loads run in a
+    # thread pool, so preload() loads models in parallel and get() waits on an in-flight load.
+
+    def __init__(self, loaders=None, max_workers: int = 4):
+        self._loaders = dict(loaders or {})
+        self._futures = {}
+        self._timings = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-loader")
+
+    def register(self, name: str, loader):
+        with self._lock:
+            self._loaders[name] = loader
+
+    def put(self, name: str, value):
+        # Register an already loaded model
+        future = Future()
+        future.set_result(value)
+        with self._lock:
+            self._futures[name] = future
+
+    def _load(self, name):
+        start = time.perf_counter()
+        value = self._loaders[name]()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._timings[name] = elapsed
+        print(f"Loaded {name} in {elapsed:.2f}s")
+        return value
+
+    def _start(self, name):
+        with self._lock:
+            future = self._futures.get(name)
+            if future is None or (future.done() and future.exception() is not None):
+                # First use, or retry after a failed load
+                if name not in self._loaders:
+                    raise KeyError(f"No loader registered for model: {name}")
+                future = self._executor.submit(self._load, name)
+                self._futures[name] = future
+            return future
+
+    def get(self, name: str):
+        return self._start(name).result()
+
+    def preload(self, names=None, wait: bool = True):
+        names = list(names) if names is not None else list(self._loaders)
+        futures = [self._start(name) for name in names]
+        if wait:
+            for future in futures:
+                future.result()
+        return futures
+
+    def names(self):
+        with self._lock:
+            return sorted(set(self._loaders) | set(self._futures))
+
+    def is_loaded(self, name: str):
+        future = self._futures.get(name)
+        return future is not None and future.done() and future.exception() is None
+
+    def timings(self):
+        with self._lock:
+            return dict(self._timings)
+
+
+if __name__ == "__main__":
+    # Fill the store ahead of time (e.g. while building a container image):
+    #   CHATBOT_MODEL_STORE=/models python model_store.py
+    import pipeline
+
+    if model_store_dir() is None:
+        raise SystemExit(f"Set {MODEL_STORE_ENV} to the store directory")
+    registry = pipeline.build_model_registry(inference_mode="fp32")
+    registry.preload()
+    for name, seconds in registry.timings().items():
+        print(f"{name:<16}{seconds:8.2f}s")
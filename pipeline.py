@@ -0,0 +1,1098 @@
+import torch
+from transformers import (
+    GPT2Tokenizer, GPT2LMHeadModel,
+    AutoTokenizer, AutoModelForSequenceClassification,
+    AutoModelForSeq2SeqLM, TextIteratorStreamer
+)
+from gliner import GLiNER
+from concurrent.futures import Future
+from threading import Event, Lock, Thread
+import copy
+import os
+import random
+import re
+import time
+from metrics import METRICS, StageStats
+from cache import LRUCache, normalize_key
+from backend import apply_inference_mode, resolve_inference_mode
+from prompt_cache import PromptCache
+from retrieval import embed_queries, load_answer_index
+from frontend import ENTITY_HEAD_DIR, FRONTEND_MODE, FRONTEND_MODES, EntityHead, FusedFrontEnd
+from model_store import ModelRegistry, persist_model, resolve_model_source
+from placeholders import DeferredPlaceholders, PlaceholderEngine
+from stage_graph import STAGE_THREADS, Stage, StageGraph, record_critical_path, stage_executor
+from speculative import DECODING_MODE, DECODING_MODES, DRAFT_CORPUS, NgramDraft, speculative_generate
+from stopping import (
+    GENERATION_DEADLINE, build_stopping_criteria, find_template_marker, record_stop_reasons, trim_holdback,
+    trim_response
+)
+
+# =============================
+# MODEL AND CONFIGURATION SETUP
+# =============================
+
+# Hugging Face model IDs
+DistilGPT2_MODEL_ID = "IamPradeep/AETCSCB_OOD_IC_DistilGPT2_Fine-tuned"
+CLASSIFIER_ID = "IamPradeep/Query_Classifier_DistilBERT"
+SPELL_CORRECTOR_ID = "oliverguhr/spelling-correction-english-base"
+GLINER_MODEL_ID = "gliner-community/gliner_small-v2.5"
+
+# GLiNER labels and the placeholder each one fills; the fused front end uses the same labels and threshold
+GLINER_LABELS = os.environ.get(
+    "CHATBOT_GLINER_LABELS", "event,city,location,concert,festival,show,match,game"
+).split(",")
+EVENT_LABELS = ["event", "concert", "festival", "show", "match", "game"]
+CITY_LABELS = ["city", "location", "venue"]
+GLINER_THRESHOLD = float(os.environ.get("CHATBOT_GLINER_THRESHOLD", "0.4"))
+
+TOO_LONG_MESSAGE = "⚠️ Your question is too long. Try something shorter like: <b>'How do I get a refund?'</b>"
+
+# Example queries offered in the UI (also the benchmark corpus)
+example_queries = [
+    "How do I buy a ticket?", "How can I upgrade my ticket for the upcoming event in Hyderabad?",
+    "How do I change my personal details on my ticket?", "How can I find details about upcoming events?",
+    "How do I contact customer service?", "How do I get a refund?", "What is the ticket cancellation fee?",
+    "How can I track my ticket cancellation status?", "How can I sell my ticket?"
+]
+
+# Random OOD Fallback Responses
+fallback_responses = [
+    "I'm sorry, but I am unable to assist with this request. If you need help regarding event tickets, I'd be happy to support you.",
+    "Apologies, but I am not able to provide assistance on this matter. Please let me know if you require help with event tickets.",
+    "Unfortunately, I cannot assist with this. However, I am here to help with any event ticket-related concerns you may have.",
+    "Regrettably, I am unable to assist with this request. If there's anything I can do regarding event tickets, feel free to ask.",
+    "I regret that I am unable to assist in this case. Please reach out if you need support related to event tickets.",
+    "Apologies, but this falls outside the scope of my support. I'm here if you need any help with event ticket issues.",
+    "I'm sorry, but I cannot assist with this particular topic. If you have questions about event tickets, I'd be glad to help.",
+    "I regret that I'm unable to provide assistance here. Please let me know how I can support you with event ticket matters.",
+    "Unfortunately, I am not equipped to assist with this. If you need help with event tickets, I am here for that.",
+    "I apologize, but I cannot help with this request. However, I'd be happy to assist with anything related to event tickets.",
+    "I'm sorry, but I'm unable to support this request. If it's about event tickets, I'll gladly help however I can.",
+    "This matter falls outside the assistance I can offer. Please let me know if you need help with event ticket-related inquiries.",
+    "Regrettably, this is not something I can assist with. I'm happy to help with any event ticket questions you may have.",
+    "I'm unable to provide support for this issue. However, I can assist with concerns regarding event tickets.",
+    "I apologize, but I cannot help with this matter. If your inquiry is related to event tickets, I'd be more than happy to assist.",
+    "I regret that I am unable to offer help in this case. I am, however, available for any event ticket-related questions.",
+    "Unfortunately, I'm not able to assist with this. Please let me know if there's anything I can do regarding event tickets.",
+    "I'm sorry, but I cannot assist with this topic. However, I'm here to help with any event ticket concerns you may have.",
+    "Apologies, but this request falls outside of my support scope. If you need help with event tickets, I'm happy to assist.",
+    "I'm afraid I can't help with this matter. If there's anything related to event tickets you need, feel free to reach out.",
+    "This is beyond what I can assist with at the moment. Let me know if there's anything I can do to help with event tickets.",
+    "Sorry, I'm unable to provide support on this issue. However, I'd be glad to assist with event ticket-related topics.",
+    "Apologies, but I can't assist with this. Please let me know if you have any event ticket inquiries I can help with.",
+    "I'm unable to help with this matter. However, if you need assistance with event tickets, I'm here for you.",
+    "Unfortunately, I can't support this request. I'd be happy to assist with anything related to event tickets instead.",
+    "I'm sorry, but I can't help with this. If your concern is related to event tickets, I'll do my best to assist.",
+    "Apologies, but this issue is outside of my capabilities. However, I'm available to help with event ticket-related requests.",
+    "I regret that I cannot assist with this particular matter. Please let me know how I can support you regarding event tickets.",
+    "I'm sorry, but I'm not able to help in this instance. I am, however, ready to assist with any questions about event tickets.",
+    "Unfortunately, I'm unable to help with this topic. Let me know if there's anything event ticket-related I can support you with."
+]
+
+# =============================
+# MODEL LOADING FUNCTIONS
+# =============================
+
+def get_device():
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+# inference_mode: "fp32", "int8", "compile" or "torchscript" (see backend.py);
+# None reads CHATBOT_INFERENCE_MODE. With CHATBOT_MODEL_STORE set, models load from
+# safetensors copies in that directory, and are saved there after their first download.
+
+def load_spell_corrector(inference_mode=None):
+    device = get_device()
+    source, kwargs = resolve_model_source(SPELL_CORRECTOR_ID)
+    tokenizer = AutoTokenizer.from_pretrained(source, **kwargs)
+    model = AutoModelForSeq2SeqLM.from_pretrained(source, **kwargs)
+    persist_model(SPELL_CORRECTOR_ID, model, tokenizer)
+    model.to(device)
+    model.eval()
+    model = apply_inference_mode(model, "spell_corrector", resolve_inference_mode("spell_corrector", inference_mode))
+    return model, tokenizer
+
+def load_gliner_model(inference_mode=None):
+    # GLiNER handles device mapping internally if possible
+    source, kwargs = resolve_model_source(GLINER_MODEL_ID)
+    model = GLiNER.from_pretrained(source, **kwargs)
+    persist_model(GLINER_MODEL_ID, model)
+    model = apply_inference_mode(model, "gliner", resolve_inference_mode("gliner", inference_mode))
+    return model
+
+def load_gpt2_tokenizer():
+    source, kwargs = resolve_model_source(DistilGPT2_MODEL_ID)
+    tokenizer = GPT2Tokenizer.from_pretrained(source, **kwargs)
+    # Batched generation pads prompts, GPT-2 ships without a pad token
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
+
+def load_gpt2_model_and_tokenizer(inference_mode=None):
+    device = get_device()
+    source, kwargs = resolve_model_source(DistilGPT2_MODEL_ID)
+    model = GPT2LMHeadModel.from_pretrained(source, trust_remote_code=True, **kwargs)
+    tokenizer = load_gpt2_tokenizer()
+    persist_model(DistilGPT2_MODEL_ID, model, tokenizer)
+    model.to(device) # Move to device ONCE during load
+    model.eval()
+    model = apply_inference_mode(model, "gpt2", resolve_inference_mode("gpt2", inference_mode))
+    return model, tokenizer
+
+def load_classifier_model(inference_mode=None):
+    device = get_device()
+    source, kwargs = resolve_model_source(CLASSIFIER_ID)
+    tokenizer = AutoTokenizer.from_pretrained(source, **kwargs)
+    model = AutoModelForSequenceClassification.from_pretrained(source, **kwargs)
+    persist_model(CLASSIFIER_ID, model, tokenizer)
+    model.to(device) # Move to device ONCE during load
+    model.eval()
+    model = apply_inference_mode(
+        model, "classifier", resolve_inference_mode("classifier", inference_mode), tokenizer
+    )
+    return model, tokenizer
+
+def build_model_registry(inference_mode=None):
+    # Nothing loads until a model is first used or preloaded
+    return ModelRegistry({
+        "spell_corrector": lambda: load_spell_corrector(inference_mode),
+        "gliner": lambda: load_gliner_model(inference_mode),
+        "gpt2": lambda: load_gpt2_model_and_tokenizer(inference_mode),
+        "gpt2_tokenizer": load_gpt2_tokenizer,
+        "classifier": lambda: load_classifier_model(inference_mode),
+    })
+
+def normalize_query(query: str):
+    query = query.strip()
+    if len(query) == 0:
+        return query
+    return query[0].upper() + query[1:].lower()
+
+def build_vocabulary(tokenizer):
+    # Whole-word entries of a WordPiece vocab (DistilBERT's is uncased) double as a cheap dictionary
+    return frozenset(
+        token for token in tokenizer.get_vocab()
+        if token.isalpha() and token.islower()
+    )
+
+def needs_spell_correction(query: str, vocabulary):
+    # Only queries with out-of-vocabulary words are worth a seq2seq pass
+    return any(word not in vocabulary for word in re.findall(r"[a-z]+", query.lower()))
+
+def preprocess_query(query: str, spell_corrector, query_tokenizer, max_tokens: int = 128, vocabulary=None):
+    spell_model, spell_tokenizer = spell_corrector
+    query = normalize_query(query)
+    if len(query) == 0:
+        return query, None
+    tokens = query_tokenizer.encode(query, add_special_tokens=True)
+    token_count = len(tokens)
+    if token_count > max_tokens:
+        return None, TOO_LONG_MESSAGE
+    if vocabulary is not None and not needs_spell_correction(query, vocabulary):
+        return query, None
+    try:
+        device = next(spell_model.parameters()).device
+        inputs = spell_tokenizer(query, return_tensors="pt", padding=True).to(device)
+        with torch.no_grad():
+            outputs = spell_model.generate(**inputs, max_length=256)
+        corrected = spell_tokenizer.decode(outputs[0], skip_special_tokens=True).strip()
+        if corrected:
+            query = corrected
+    except Exception as e:
+        print(f"Spell correction error: {e}")
+        METRICS.inc("chatbot_errors_total", stage="spell_correction")
+    return query, None
+
+def is_ood(query: str, model, tokenizer):
+    # Detect which device the model is already on
+    device = next(model.parameters()).device
+    model.eval()
+    
+    inputs = tokenizer(query, return_tensors="pt", truncation=True, padding=True, max_length=256)
+    inputs = {k: v.to(device) for k, v in inputs.items()}
+    with torch.no_grad():
+        outputs = model(**inputs)
+    pred_id = torch.argmax(outputs.logits, dim=1).item()
+    return pred_id == 1 
+
+# =============================
+# ORIGINAL HELPER FUNCTIONS
+# =============================
+
+static_placeholders = {
+    "{{WEBSITE_URL}}": "[website](https://github.com/MarpakaPradeepSai)",
+    "{{SUPPORT_TEAM_LINK}}": "[support team](https://github.com/MarpakaPradeepSai)",
+    "{{CONTACT_SUPPORT_LINK}}" : "[support team](https://github.com/MarpakaPradeepSai)",
+    "{{SUPPORT_CONTACT_LINK}}" : "[support team](https://github.com/MarpakaPradeepSai)",
+    "{{CANCEL_TICKET_SECTION}}": "<b>Ticket Cancellation</b>",
+    "{{CANCEL_TICKET_OPTION}}": "<b>Cancel Ticket</b>",
+    "{{GET_REFUND_OPTION}}": "<b>Get Refund</b>",
+    "{{UPGRADE_TICKET_INFORMATION}}": "<b>Upgrade Ticket Information</b>",
+    "{{TICKET_SECTION}}": "<b>Ticketing</b>",
+    "{{CANCELLATION_POLICY_SECTION}}": "<b>Cancellation Policy</b>",
+    "{{CHECK_CANCELLATION_POLICY_OPTION}}": "<b>Check Cancellation Policy</b>",
+    "{{APP}}": "<b>App</b>",
+    "{{CHECK_CANCELLATION_FEE_OPTION}}": "<b>Check Cancellation Fee</b>",
+    "{{CHECK_REFUND_POLICY_OPTION}}": "<b>Check Refund Policy</b>",
+    "{{CHECK_PRIVACY_POLICY_OPTION}}": "<b>Check Privacy Policy</b>",
+    "{{SAVE_BUTTON}}": "<b>Save</b>",
+    "{{EDIT_BUTTON}}": "<b>Edit</b>",
+    "{{CANCELLATION_FEE_SECTION}}": "<b>Cancellation Fee</b>",
+    "{{CHECK_CANCELLATION_FEE_INFORMATION}}": "<b>Check Cancellation Fee Information</b>",
+    "{{PRIVACY_POLICY_LINK}}": "<b>Privacy Policy</b>",
+    "{{REFUND_SECTION}}": "<b>Refund</b>",
+    "{{REFUND_POLICY_LINK}}": "<b>Refund Policy</b>",
+    "{{CUSTOMER_SERVICE_SECTION}}": "<b>Customer Service</b>",
+    "{{DELIVERY_PERIOD_INFORMATION}}": "<b>Delivery Period</b>",
+    "{{EVENT_ORGANIZER_OPTION}}": "<b>Event Organizer</b>",
+    "{{FIND_TICKET_OPTION}}": "<b>Find Ticket</b>",
+    "{{FIND_UPCOMING_EVENTS_OPTION}}": "<b>Find Upcoming Events</b>",
+    "{{CONTACT_SECTION}}": "<b>Contact</b>",
+    "{{SEARCH_BUTTON}}": "<b>Search</b>",
+    "{{SUPPORT_SECTION}}": "<b>Support</b>",
+    "{{EVENTS_SECTION}}": "<b>Events</b>",
+    "{{EVENTS_PAGE}}": "<b>Events</b>",
+    "{{TYPE_EVENTS_OPTION}}": "<b>Type Events</b>",
+    "{{PAYMENT_SECTION}}": "<b>Payment</b>",
+    "{{PAYMENT_OPTION}}": "<b>Payment</b>",
+    "{{CANCELLATION_SECTION}}": "<b>Cancellation</b>",
+    "{{CANCELLATION_OPTION}}": "<b>Cancellation</b>",
+    "{{REFUND_OPTION}}": "<b>Refund</b>",
+    "{{TRANSFER_TICKET_OPTION}}": "<b>Transfer Ticket</b>",
+    "{{REFUND_STATUS_OPTION}}": "<b>Refund Status</b>",
+    "{{DELIVERY_SECTION}}": "<b>Delivery</b>",
+    "{{SELL_TICKET_OPTION}}": "<b>Sell Ticket</b>",
+    "{{CANCELLATION_FEE_INFORMATION}}": "<b>Cancellation Fee Information</b>",
+    "{{CUSTOMER_SUPPORT_PAGE}}": "<b>Customer Support</b>",
+    "{{PAYMENT_METHOD}}" : "<b>Payment</b>",
+    "{{VIEW_PAYMENT_METHODS}}": "<b>View Payment Methods</b>",
+    "{{VIEW_CANCELLATION_POLICY}}": "<b>View Cancellation Policy</b>",
+    "{{SUPPORT_ SECTION}}" : "<b>Support</b>",
+    "{{CUSTOMER_SUPPORT_SECTION}}" : "<b>Customer Support</b>",
+    "{{HELP_SECTION}}" : "<b>Help</b>",
+    "{{TICKET_INFORMATION}}" : "<b>Ticket Information</b>",
+    "{{UPGRADE_TICKET_BUTTON}}" : "<b>Upgrade Ticket</b>",
+    "{{CANCEL_TICKET_BUTTON}}" : "<b>Cancel Ticket</b>",
+    "{{GET_REFUND_BUTTON}}" : "<b>Get Refund</b>",
+    "{{PAYMENTS_HELP_SECTION}}" : "<b>Payments Help</b>",
+    "{{PAYMENTS_PAGE}}" : "<b>Payments</b>",
+    "{{TICKET_DETAILS}}" : "<b>Ticket Details</b>",
+    "{{TICKET_INFORMATION_PAGE}}" : "<b>Ticket Information</b>",
+    "{{REPORT_PAYMENT_PROBLEM}}" : "<b>Report Payment</b>",
+    "{{TICKET_OPTIONS}}" : "<b>Ticket Options</b>",
+    "{{SEND_BUTTON}}" : "<b>Send</b>",
+    "{{PAYMENT_ISSUE_OPTION}}" : "<b>Payment Issue</b>",
+    "{{CUSTOMER_SUPPORT_PORTAL}}" : "<b>Customer Support</b>",
+    "{{UPGRADE_TICKET_OPTION}}" : "<b>Upgrade Ticket</b>",
+    "{{TICKET_AVAILABILITY_TAB}}" : "<b>Ticket Availability</b>",
+    "{{TRANSFER_TICKET_BUTTON}}" : "<b>Transfer Ticket</b>",
+    "{{TICKET_MANAGEMENT}}" : "<b>Ticket Management</b>",
+    "{{TICKET_STATUS_TAB}}" : "<b>Ticket Status</b>",
+    "{{TICKETING_PAGE}}" : "<b>Ticketing</b>",
+    "{{TICKET_TRANSFER_TAB}}" : "<b>Ticket Transfer</b>",
+    "{{CURRENT_TICKET_DETAILS}}" : "<b>Current Ticket Details</b>",
+    "{{UPGRADE_OPTION}}" : "<b>Upgrade</b>",
+    "{{CONNECT_WITH_ORGANIZER}}" : "<b>Connect with Organizer</b>",
+    "{{TICKETS_TAB}}" : "<b>Tickets</b>",
+    "{{ASSISTANCE_SECTION}}" : "<b>Assistance Section</b>",
+}
+
+# One compiled pass over each response instead of a str.replace per template
+PLACEHOLDERS = PlaceholderEngine(static_placeholders)
+
+def replace_placeholders(response, dynamic_placeholders, engine=PLACEHOLDERS, placeholder_info=None):
+    return engine.substitute(response, dynamic_placeholders, placeholder_info)
+
+def entities_to_placeholders(entities):
+    dynamic_placeholders = {'{{EVENT}}': "event", '{{CITY}}': "city"}
+    
+    for ent in entities:
+        if ent["label"] in EVENT_LABELS:
+            dynamic_placeholders['{{EVENT}}'] = f"<b>{ent['text'].title()}</b>"
+        elif ent["label"] in CITY_LABELS:
+            dynamic_placeholders['{{CITY}}'] = f"<b>{ent['text']}</b>"
+    
+    return dynamic_placeholders
+
+def extract_dynamic_placeholders(user_question, gliner_model):
+    entities = gliner_model.predict_entities(user_question, GLINER_LABELS, threshold=GLINER_THRESHOLD)
+    return entities_to_placeholders(entities)
+
+# Generation stops at EOS, max_length, or the first criterion in stopping.py that fires (token
+# budget, restarted template, repeated n-grams, deadline); generation_info gets "stop_reason".
+# With a draft (speculative.NgramDraft), tokens are drafted and verified several at a time.
+
+def generate_response(model, tokenizer, instruction, max_length=256, prompt_cache=None, generation_info=None,
+                      deadline=None, draft=None):
+    model.eval()
+    # Detect which device the model is already on
+    device = next(model.parameters()).device
+    input_text = f"Instruction: {instruction} Response:"
+    # Unpadded, like the length guard: see ChatbotPipeline.batch_tokenizer
+    inputs = tokenizer(input_text, return_tensors="pt").to(device)
+    # Start from the cached key/values of the prompt prefix, if any
+    past_key_values = prompt_cache.lookup(inputs["input_ids"])[0] if prompt_cache is not None else None
+    stop_reasons = {}
+    stopping_criteria = build_stopping_criteria(tokenizer, inputs, stop_reasons, deadline)
+    with torch.no_grad():
+        if draft is not None:
+            outputs = speculative_generate(
+                model, inputs["input_ids"], draft, max_length, tokenizer.eos_token_id,
+                stopping_criteria=stopping_criteria, past_key_values=past_key_values,
+                do_sample=True, temperature=0.5, top_p=0.95
+            )
+        else:
+            outputs = model.generate(
+                input_ids=inputs["input_ids"],
+                attention_mask=inputs["attention_mask"],
+                max_length=max_length,
+                num_return_sequences=1,
+                temperature=0.5,
+                top_p=0.95,
+                do_sample=True,
+                pad_token_id=tokenizer.eos_token_id,
+                past_key_values=past_key_values,
+                stopping_criteria=stopping_criteria,
+                return_dict_in_generate=True
+            )
+    if prompt_cache is not None:
+        prompt_cache.store(inputs["input_ids"], outputs.past_key_values)
+    stop_reason = record_stop_reasons(stop_reasons, outputs.sequences, tokenizer.eos_token_id, max_length)[0]
+    if generation_info is not None:
+        generation_info["new_tokens"] = count_new_tokens(
+            outputs.sequences, inputs["input_ids"].shape[1], tokenizer.eos_token_id
+        )[0]
+        generation_info["stop_reason"] = stop_reason
+    response = tokenizer.decode(outputs.sequences[0], skip_special_tokens=True)
+    response_start = response.find("Response:") + len("Response:")
+    return trim_response(response[response_start:], stop_reason)
+
+def stream_response(model, tokenizer, instruction, max_length=256, prompt_cache=None, generation_info=None,
+                    deadline=None, draft=None, cancelled=None):
+    # Same decoding setup as generate_response, but yields decoded text as tokens are produced.
+    # cancelled (a threading.Event) lets another thread stop the generation at its next token.
+    model.eval()
+    device = next(model.parameters()).device
+    input_text = f"Instruction: {instruction} Response:"
+    inputs = tokenizer(input_text, return_tensors="pt").to(device)
+    past_key_values = prompt_cache.lookup(inputs["input_ids"])[0] if prompt_cache is not None else None
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    stop_reasons = {}
+    outcome = {} # "stop_reason", once generation has finished
+    if cancelled is None:
+        cancelled = Event() # Set if the consumer closes this generator before the end
+    generation_kwargs = dict(
+        input_ids=inputs["input_ids"],
+        attention_mask=inputs["attention_mask"],
+        max_length=max_length,
+        num_return_sequences=1,
+        temperature=0.5,
+        top_p=0.95,
+        do_sample=True,
+        pad_token_id=tokenizer.eos_token_id,
+        past_key_values=past_key_values,
+        stopping_criteria=build_stopping_criteria(tokenizer, inputs, stop_reasons, deadline, cancelled),
+        return_dict_in_generate=True,
+        streamer=streamer
+    )
+    errors = []
+
+    def run_generation():
+        try:
+            with torch.no_grad():
+                if draft is not None:
+                    outputs = speculative_generate(
+                        model, inputs["input_ids"], draft, max_length, tokenizer.eos_token_id,
+                        stopping_criteria=generation_kwargs["stopping_criteria"], past_key_values=past_key_values,
+                        do_sample=True, temperature=0.5, top_p=0.95, streamer=streamer
+                    )
+                else:
+                    outputs = model.generate(**generation_kwargs)
+            if prompt_cache is not None:
+                prompt_cache.store(inputs["input_ids"], outputs.past_key_values)
+            stop_reason = record_stop_reasons(stop_reasons, outputs.sequences, tokenizer.eos_token_id, max_length)[0]
+            outcome["stop_reason"] = stop_reason
+            if generation_info is not None:
+                generation_info["new_tokens"] = count_new_tokens(
+                    outputs.sequences, inputs["input_ids"].shape[1], tokenizer.eos_token_id
+                )[0]
+                generation_info["stop_reason"] = stop_reason
+        except Exception as e:
+            errors.append(e)
+            streamer.end() # Unblock the consumer loop below
+    
+    thread = Thread(target=run_generation, daemon=True)
+    thread.start()
+    started = False
+    emitted = ""
+    # The unfinished last sentence is held back: it may become a restarted template marker, and
+    # trim_response drops it if generation is cut short
+    pending = ""
+    stopped = False
+    try:
+        for text in streamer:
+            # generate_response strips the whitespace that follows "Response:"
+            if not started:
+                text = text.lstrip()
+            if not text or stopped:
+                continue
+            started = True
+            pending += text
+            cut = find_template_marker(pending)
+            if cut != -1:
+                # The model began a new example; the criterion stops it after this token
+                pending, stopped = pending[:cut], True
+                continue
+            hold = trim_holdback(pending)
+            ready, pending = pending[:len(pending) - hold], pending[len(pending) - hold:]
+            if ready:
+                emitted += ready
+                yield ready
+        thread.join()
+        if errors:
+            raise errors[0]
+        # Same text as generate_response: the held-back tail is trimmed once the stop reason is known
+        response = trim_response(emitted + pending, outcome.get("stop_reason"))
+        if response.startswith(emitted) and len(response) > len(emitted):
+            yield response[len(emitted):]
+    except GeneratorExit:
+        # Closed early (e.g. the client disconnected): stop generating at the next token
+        cancelled.set()
+        raise
+
+# =============================
+# BATCHED INFERENCE
+# =============================
+
+def validate_queries(queries, query_tokenizer, max_tokens: int = 128):
+    # Normalization and the length guard, with one tokenizer call for the whole batch
+    normalized = [normalize_query(query) for query in queries]
+    results = [(query, None) for query in normalized]
+    non_empty = [i for i, query in enumerate(normalized) if query]
+    if non_empty:
+        encoded = query_tokenizer([normalized[i] for i in non_empty], add_special_tokens=True)["input_ids"]
+        for i, tokens in zip(non_empty, encoded):
+            if len(tokens) > max_tokens:
+                results[i] = (None, TOO_LONG_MESSAGE)
+    return results
+
+def correct_spelling_batch(queries, spell_corrector):
+    # One padded seq2seq pass; queries are returned unchanged if correction fails
+    spell_model, spell_tokenizer = spell_corrector
+    queries = list(queries)
+    if not queries:
+        return queries
+    try:
+        device = next(spell_model.parameters()).device
+        inputs = spell_tokenizer(queries, return_tensors="pt", padding=True).to(device)
+        with torch.no_grad():
+            outputs = spell_model.generate(**inputs, max_length=256)
+        corrected = spell_tokenizer.batch_decode(outputs, skip_special_tokens=True)
+        return [text.strip() or query for query, text in zip(queries, corrected)]
+    except Exception as e:
+        print(f"Spell correction error: {e}")
+        METRICS.inc("chatbot_errors_total", stage="spell_correction")
+        return queries
+
+def preprocess_queries(queries, spell_corrector, query_tokenizer, max_tokens: int = 128, vocabulary=None):
+    # Batched preprocess_query
+    results = validate_queries(queries, query_tokenizer, max_tokens)
+    to_correct = [
+        i for i, (query, error) in enumerate(results)
+        if query and (vocabulary is None or needs_spell_correction(query, vocabulary))
+    ]
+    corrected = correct_spelling_batch([results[i][0] for i in to_correct], spell_corrector)
+    for i, text in zip(to_correct, corrected):
+        results[i] = (text, None)
+    return results
+
+def is_ood_batch(queries, model, tokenizer):
+    if not queries:
+        return []
+    device = next(model.parameters()).device
+    inputs = tokenizer(list(queries), return_tensors="pt", truncation=True, padding=True, max_length=256)
+    inputs = {k: v.to(device) for k, v in inputs.items()}
+    with torch.no_grad():
+        outputs = model(**inputs)
+    pred_ids = torch.argmax(outputs.logits, dim=1).tolist()
+    return [pred_id == 1 for pred_id in pred_ids]
+
+def extract_dynamic_placeholders_batch(user_questions, gliner_model):
+    if not user_questions:
+        return []
+    all_entities = gliner_model.inference(
+        list(user_questions), GLINER_LABELS, threshold=GLINER_THRESHOLD, batch_size=len(user_questions)
+    )
+    return [entities_to_placeholders(entities) for entities in all_entities]
+
+def count_new_tokens(sequences, prompt_length, eos_token_id):
+    # Generated tokens per row, not counting EOS/padding
+    return (sequences[:, prompt_length:] != eos_token_id).sum(dim=1).tolist()
+
+def generate_responses(model, tokenizer, instructions, max_length=256, generation_info=None, deadline=None):
+    # generation_info, if given, receives "new_tokens" and "stop_reasons", one entry per instruction
+    if not instructions:
+        return []
+    device = next(model.parameters()).device
+    input_texts = [f"Instruction: {instruction} Response:" for instruction in instructions]
+    # Decoder-only models continue from the last position, so pad on the left
+    inputs = tokenizer(input_texts, return_tensors="pt", padding=True, padding_side="left").to(device)
+    stop_reasons = {}
+    with torch.no_grad():
+        outputs = model.generate(
+            input_ids=inputs["input_ids"],
+            attention_mask=inputs["attention_mask"],
+            max_length=max_length,
+            num_return_sequences=1,
+            temperature=0.5,
+            top_p=0.95,
+            do_sample=True,
+            pad_token_id=tokenizer.eos_token_id,
+            stopping_criteria=build_stopping_criteria(tokenizer, inputs, stop_reasons, deadline)
+        )
+    reasons = record_stop_reasons(stop_reasons, outputs, tokenizer.eos_token_id, max_length)
+    if generation_info is not None:
+        generation_info["new_tokens"] = count_new_tokens(outputs, inputs["input_ids"].shape[1], tokenizer.eos_token_id)
+        generation_info["stop_reasons"] = reasons
+    responses = []
+    for response, reason in zip(tokenizer.batch_decode(outputs, skip_special_tokens=True), reasons):
+        response_start = response.find("Response:") + len("Response:")
+        responses.append(trim_response(response[response_start:], reason))
+    return responses
+
+# =============================
+# PIPELINE
+# =============================
+
+class ChatbotPipeline:
+    # UI-free wrapper around the models, shared by the Streamlit app and headless callers.
+    # Stages run cheapest first: length guard, OOD check, then spell correction only for
+    # in-domain queries with out-of-vocabulary words. Stage results and final responses are
+    # cached on the normalized query (cache_size=0 turns caching off).
+    # Models come from a ModelRegistry, so a model a query never reaches is never loaded.
+    # decoding="ngram" drafts tokens from past responses for single-query generation.
+    # With an AnswerIndex (answer_index=, or CHATBOT_ANSWER_INDEX), queries close enough to a
+    # frequent intent get its stored answer instead of a generated one.
+    # frontend="fused" replaces the classifier + GLiNER passes (and retrieval's embedding pass)
+    # with one DistilBERT pass, using an EntityHead (entity_head=, or CHATBOT_ENTITY_HEAD).
+    # answer_batch is a StageGraph: stages that don't depend on each other (the length guard and
+    # the OOD check, GLiNER and generation) run side by side on stage_threads threads.
+
+    CACHE_NAMES = ("corrected", "ood", "entities", "response")
+
+    def __init__(self, spell_corrector=None, gliner_model=None, gpt2_model=None, gpt2_tokenizer=None,
+                 clf_model=None, clf_tokenizer=None, max_tokens: int = 128, vocabulary=None,
+                 cache_size: int = 1024, cache_ttl: float = 3600.0, prompt_cache_size: int = 32,
+                 models=None, placeholders=None, decoding: str = None, answer_index=None, frontend: str = None,
+                 entity_head=None, stage_threads: int = None):
+        self.models = models if models is not None else ModelRegistry()
+        if spell_corrector is not None:
+            self.models.put("spell_corrector", spell_corrector)
+        if gliner_model is not None:
+            self.models.put("gliner", gliner_model)
+        if gpt2_model is not None:
+            self.models.put("gpt2", (gpt2_model, gpt2_tokenizer))
+        if gpt2_tokenizer is not None:
+            self.models.put("gpt2_tokenizer", gpt2_tokenizer)
+        if clf_model is not None:
+            self.models.put("classifier", (clf_model, clf_tokenizer))
+        self.max_tokens = max_tokens
+        self.placeholders = placeholders if placeholders is not None else PLACEHOLDERS
+        self._vocabulary = vocabulary
+        self._prompt_cache = None
+        self._prompt_cache_size = prompt_cache_size
+        self.decoding = decoding or DECODING_MODE
+        if self.decoding not in DECODING_MODES:
+            raise ValueError(f"Unknown decoding mode: {self.decoding} (expected one of {', '.join(DECODING_MODES)})")
+        self._draft = None
+        self.answer_index = answer_index if answer_index is not None else load_answer_index()
+        self._classifier_lock = Lock() # OOD checks and retrieval share the classifier's fast tokenizer
+        self.frontend = frontend or FRONTEND_MODE
+        if self.frontend not in FRONTEND_MODES:
+            raise ValueError(f"Unknown front end: {self.frontend} (expected one of {', '.join(FRONTEND_MODES)})")
+        self._entity_head = entity_head
+        self._front_end = None
+        # Fused results for recent queries, so the OOD, entity and retrieval stages share one pass
+        # even with caching off
+        self._front_end_results = LRUCache(256, 60.0)
+        self._batch_tokenizer = None
+        self._gliner_lock = Lock() # GLiNER can now run on a stage thread while a stream extracts too
+        self.stage_threads = STAGE_THREADS if stage_threads is None else stage_threads
+        self._stage_executor = None
+        self._stage_pid = None
+        self._lazy_lock = Lock()
+        self.stats = StageStats()
+        self.caches = {name: LRUCache(cache_size, cache_ttl) for name in self.CACHE_NAMES}
+
+    @classmethod
+    def from_pretrained(cls, inference_mode=None, lazy: bool = True, **kwargs):
+        # lazy=False loads all four models up front, in parallel
+        chatbot = cls(models=build_model_registry(inference_mode), **kwargs)
+        if not lazy:
+            chatbot.preload()
+        return chatbot
+
+    # --- Models, loaded on first use ---
+
+    @property
+    def spell_corrector(self):
+        return self.models.get("spell_corrector")
+
+    @property
+    def gliner_model(self):
+        return self.models.get("gliner")
+
+    @property
+    def gpt2_model(self):
+        return self.models.get("gpt2")[0]
+
+    @property
+    def gpt2_tokenizer(self):
+        return self.models.get("gpt2_tokenizer")
+
+    @property
+    def batch_tokenizer(self):
+        # A fast tokenizer changes its padding settings in place when a call pads differently from
+        # the last one, which fails ("Already borrowed") while another thread encodes or decodes
+        # with it. Every other DistilGPT2 tokenizer call (length guard, single prompts, streaming,
+        # stopping criteria) leaves padding off, so left-padded batches get their own copy.
+        if self._batch_tokenizer is None:
+            with self._lazy_lock:
+                if self._batch_tokenizer is None:
+                    tokenizer = copy.deepcopy(self.gpt2_tokenizer)
+                    tokenizer(["", " "], padding=True, padding_side="left") # Settle the padding settings now
+                    self._batch_tokenizer = tokenizer
+        return self._batch_tokenizer
+
+    @property
+    def clf_model(self):
+        return self.models.get("classifier")[0]
+
+    @property
+    def clf_tokenizer(self):
+        return self.models.get("classifier")[1]
+
+    @property
+    def vocabulary(self):
+        if self._vocabulary is None:
+            with self._lazy_lock:
+                if self._vocabulary is None:
+                    self._vocabulary = build_vocabulary(self.clf_tokenizer)
+        return self._vocabulary
+
+    @property
+    def prompt_cache(self):
+        # KV-cache for the "Instruction:" prefix and recent prompts (prompt_cache_size=0 keeps only the prefix)
+        if self._prompt_cache is None:
+            with self._lazy_lock:
+                if self._prompt_cache is None:
+                    self._prompt_cache = PromptCache(
+                        self.gpt2_model, self.gpt2_tokenizer, maxsize=self._prompt_cache_size
+                    )
+        return self._prompt_cache
+
+    @property
+    def draft(self):
+        # Draft corpus for speculative decoding, None with standard decoding
+        if self.decoding == "standard":
+            return None
+        if self._draft is None:
+            with self._lazy_lock:
+                if self._draft is None:
+                    if DRAFT_CORPUS:
+                        self._draft = NgramDraft.from_file(self.gpt2_tokenizer, DRAFT_CORPUS)
+                    else:
+                        self._draft = NgramDraft()
+        return self._draft
+
+    @property
+    def front_end(self):
+        # The FusedFrontEnd, or None in separate mode. Without a usable entity head the pipeline
+        # falls back to separate mode.
+        if self.frontend != "fused":
+            return None
+        if self._front_end is None:
+            with self._lazy_lock:
+                if self._front_end is None and self.frontend == "fused":
+                    try:
+                        head = self._entity_head
+                        if head is None:
+                            if not ENTITY_HEAD_DIR:
+                                raise ValueError("CHATBOT_ENTITY_HEAD is not set")
+                            head = EntityHead.load(ENTITY_HEAD_DIR)
+                        self._front_end = FusedFrontEnd(
+                            self.clf_model, self.clf_tokenizer, head, GLINER_LABELS, GLINER_THRESHOLD
+                        )
+                    except (OSError, ValueError, KeyError, RuntimeError) as e:
+                        print(f"Fused front end unavailable, using the classifier and GLiNER: {e}")
+                        self.frontend = "separate"
+        return self._front_end
+
+    @property
+    def stage_executor(self):
+        # Thread pool for concurrent stages (None runs them in the caller). Threads don't survive
+        # a fork, so a forked worker builds its own pool on first use.
+        if self.stage_threads <= 0:
+            return None
+        if self._stage_pid != os.getpid():
+            with self._lazy_lock:
+                if self._stage_pid != os.getpid():
+                    self._stage_executor = stage_executor(self.stage_threads)
+                    self._stage_pid = os.getpid()
+        return self._stage_executor
+
+    def preload(self, names=None, wait: bool = True):
+        # Load models ahead of first use (all of them by default), in parallel. The fused front
+        # end replaces GLiNER, so it is left out even when named; it still loads on first use if
+        # the front end falls back to separate mode.
+        if self.frontend == "fused":
+            names = [name for name in (self.models.names() if names is None else names) if name != "gliner"]
+        return self.models.preload(names, wait=wait)
+
+    def startup_timings(self):
+        return self.models.timings()
+
+    # --- Single-query stages, used by the streaming UI ---
+
+    def validate(self, query: str):
+        return self.validate_batch([query])[0]
+
+    def correct(self, query: str):
+        return self.correct_batch([query])[0]
+
+    def preprocess(self, query: str):
+        return self.preprocess_batch([query])[0]
+
+    def is_ood(self, query: str):
+        return self.is_ood_batch([query])[0]
+
+    def extract_placeholders(self, query: str):
+        return self.extract_placeholders_batch([query])[0]
+
+    def retrieve(self, query: str):
+        return self.retrieve_batch([query])[0]
+
+    def stream_response(self, query: str, dynamic_placeholders=None, started_at: float = None, cancelled=None):
+        # A cached answer comes back as a single chunk, a fresh one is cached once fully streamed.
+        # started_at (a time.perf_counter() value) lets time-to-first-token include earlier stages.
+        # Setting cancelled (a threading.Event) stops the generation, like closing this generator.
+        # dynamic_placeholders may be the dict, a Future of it (e.g. from the scheduler), or None to
+        # extract them here; either way generation starts without waiting for GLiNER.
+        start = started_at if started_at is not None else time.perf_counter()
+        key = normalize_key(query)
+        cached = self.caches["response"].get(key)
+        if cached is not None:
+            self.stats.registry.observe("chatbot_time_to_first_token_seconds", time.perf_counter() - start)
+            yield cached
+            return
+        if dynamic_placeholders is None:
+            dynamic_placeholders = self._extract_placeholders_deferred(query)
+        elif isinstance(dynamic_placeholders, Future):
+            dynamic_placeholders = DeferredPlaceholders(dynamic_placeholders)
+        retrieve_start = time.perf_counter()
+        retrieved = self.retrieve(query)
+        if retrieved is not None:
+            retrieve_seconds = time.perf_counter() - retrieve_start
+            with self.stats.timer("replace_placeholders"):
+                response = self.placeholders.substitute(retrieved, dynamic_placeholders)
+            self.stats.registry.observe("chatbot_time_to_first_token_seconds", time.perf_counter() - start)
+            self._record_stream_path("retrieval", retrieve_seconds, dynamic_placeholders)
+            self.caches["response"].set(key, response)
+            yield response
+            return
+        generation_info = {}
+        generation_seconds = [0.0] # Time spent waiting on DistilGPT2, the rest is placeholder replacement
+
+        def timed_tokens():
+            # The generation deadline counts from the start of the request
+            tokens = stream_response(
+                self.gpt2_model, self.gpt2_tokenizer, query,
+                prompt_cache=self.prompt_cache, generation_info=generation_info,
+                deadline=start + GENERATION_DEADLINE if GENERATION_DEADLINE > 0 else None, draft=self.draft,
+                cancelled=cancelled
+            )
+            while True:
+                t = time.perf_counter()
+                try:
+                    text = next(tokens)
+                except StopIteration:
+                    generation_seconds[0] += time.perf_counter() - t
+                    return
+                generation_seconds[0] += time.perf_counter() - t
+                yield text
+
+        chunks = []
+        busy_seconds = 0.0 # Excludes time the consumer spends rendering between chunks
+        placeholder_stream = self.placeholders.stream(timed_tokens(), dynamic_placeholders)
+        while True:
+            t = time.perf_counter()
+            text = next(placeholder_stream, None)
+            busy_seconds += time.perf_counter() - t
+            if text is None:
+                break
+            if not chunks:
+                self.stats.registry.observe("chatbot_time_to_first_token_seconds", time.perf_counter() - start)
+            chunks.append(text)
+            yield text
+        waited = getattr(dynamic_placeholders, "waited", 0.0)
+        self.stats.record("generate", generation_seconds[0])
+        self.stats.record("replace_placeholders", busy_seconds - generation_seconds[0] - waited)
+        self._record_stream_path("generate", generation_seconds[0], dynamic_placeholders)
+        if "new_tokens" in generation_info:
+            self.stats.registry.observe("chatbot_generated_tokens", generation_info["new_tokens"])
+        response = "".join(chunks).strip()
+        if response:
+            self.caches["response"].set(key, response)
+
+    def _extract_placeholders_deferred(self, query: str):
+        # GLiNER on a stage thread while this thread retrieves and generates
+        executor = self.stage_executor
+        if executor is None:
+            return self.extract_placeholders(query)
+        return DeferredPlaceholders(executor.submit(self.extract_placeholders, query))
+
+    def _record_stream_path(self, stage: str, seconds: float, dynamic_placeholders):
+        # A stream's critical path: the answer, then any wait for placeholders it didn't hide
+        if not isinstance(dynamic_placeholders, DeferredPlaceholders):
+            return
+        path = [(stage, seconds)]
+        if dynamic_placeholders.waited:
+            path.append(("placeholders", dynamic_placeholders.waited))
+        hidden = (dynamic_placeholders.seconds or 0.0) - dynamic_placeholders.waited
+        record_critical_path("stream", path, hidden, self.stats.registry)
+
+    # --- Caching ---
+
+    def _cached(self, cache_name, queries, compute):
+        # Look every query up, run compute() once over the misses, store what it returns
+        cache = self.caches[cache_name]
+        keys = [normalize_key(query) for query in queries]
+        results = [cache.get(key) for key in keys]
+        misses = [i for i, result in enumerate(results) if result is None]
+        if misses:
+            computed = compute([queries[i] for i in misses])
+            for i, value in zip(misses, computed):
+                results[i] = value
+                cache.set(keys[i], value)
+        return results
+
+    def warm_cache(self, queries):
+        # Precompute answers (e.g. the UI's example queries) so first askers get cache hits
+        return self.answer_batch(queries)
+
+    def cache_stats(self):
+        return {name: cache.stats() for name, cache in self.caches.items()}
+
+    def clear_caches(self):
+        for cache in self.caches.values():
+            cache.clear()
+
+    # --- Batched stages, used by the request scheduler ---
+
+    def validate_batch(self, queries):
+        # Length guard uses the DistilGPT2 tokenizer
+        with self.stats.timer("validate", len(queries)):
+            results = validate_queries(queries, self.gpt2_tokenizer, self.max_tokens)
+        too_long = sum(1 for _, error in results if error)
+        if too_long:
+            self.stats.registry.inc("chatbot_queries_total", too_long, result="too_long")
+        return results
+
+    def correct_batch(self, queries):
+        return self._cached("corrected", list(queries), self._correct_uncached)
+
+    def _correct_uncached(self, queries):
+        # Queries whose words are all in the vocabulary skip the seq2seq corrector
+        queries = list(queries)
+        to_correct = [i for i, query in enumerate(queries) if needs_spell_correction(query, self.vocabulary)]
+        self.stats.skip("spell_correction", len(queries) - len(to_correct))
+        if to_correct:
+            with self.stats.timer("spell_correction", len(to_correct)):
+                corrected = correct_spelling_batch([queries[i] for i in to_correct], self.spell_corrector)
+            for i, text in zip(to_correct, corrected):
+                queries[i] = text
+        return queries
+
+    def preprocess_batch(self, queries):
+        # Length guard plus spell correction, without the OOD short-circuit
+        results = self.validate_batch(queries)
+        valid = [i for i, (query, error) in enumerate(results) if query]
+        corrected = self.correct_batch([results[i][0] for i in valid])
+        for i, text in zip(valid, corrected):
+            results[i] = (text, None)
+        return results
+
+    def is_ood_batch(self, queries):
+        flags = self._cached("ood", list(queries), self._is_ood_uncached)
+        self._count_ood(flags)
+        return flags
+
+    def _count_ood(self, flags):
+        ood = sum(1 for flag in flags if flag)
+        if ood:
+            self.stats.registry.inc("chatbot_queries_total", ood, result="ood")
+        if len(flags) - ood:
+            self.stats.registry.inc("chatbot_queries_total", len(flags) - ood, result="in_domain")
+
+    def _is_ood_uncached(self, queries):
+        if self.front_end is not None:
+            return [result["is_ood"] for result in self._front_end_batch(queries)]
+        with self.stats.timer("is_ood", len(queries)), self._classifier_lock:
+            return is_ood_batch(queries, self.clf_model, self.clf_tokenizer)
+
+    def _front_end_batch(self, queries):
+        # One fused pass over the queries not seen in the last few batches. The lookup is under
+        # the lock too, so entity extraction and retrieval running side by side share one pass.
+        keys = [normalize_key(query) for query in queries]
+        with self._classifier_lock:
+            results = [self._front_end_results.get(key) for key in keys]
+            misses = [i for i, result in enumerate(results) if result is None]
+            if misses:
+                with self.stats.timer("front_end", len(misses)):
+                    computed = self.front_end.run([queries[i] for i in misses])
+                for i, result in zip(misses, computed):
+                    results[i] = result
+                    self._front_end_results.set(keys[i], result)
+        return results
+
+    def retrieve_batch(self, queries):
+        # The stored answer (placeholders not yet filled) per query, None where generation is needed
+        queries = list(queries)
+        if self.answer_index is None or not queries:
+            return [None] * len(queries)
+        try:
+            if self.front_end is not None:
+                embeddings = [result["embedding"] for result in self._front_end_batch(queries)]
+                return self.answer_index.search(embeddings)
+            with self.stats.timer("retrieval", len(queries)):
+                with self._classifier_lock:
+                    embeddings = embed_queries(queries, self.clf_model, self.clf_tokenizer)
+                return self.answer_index.search(embeddings)
+        except Exception as e:
+            print(f"Answer retrieval error: {e}")
+            METRICS.inc("chatbot_errors_total", stage="retrieval")
+            return [None] * len(queries)
+
+    def extract_placeholders_batch(self, queries):
+        return self._cached("entities", list(queries), self._extract_placeholders_uncached)
+
+    def _extract_placeholders_uncached(self, queries):
+        if self.front_end is not None:
+            return [entities_to_placeholders(result["entities"]) for result in self._front_end_batch(queries)]
+        with self.stats.timer("placeholders", len(queries)), self._gliner_lock:
+            return extract_dynamic_placeholders_batch(queries, self.gliner_model)
+
+    def generate_batch(self, queries):
+        generation_info = {}
+        with self.stats.timer("generate", len(queries)):
+            if len(queries) == 1 and self.draft is not None:
+                # Speculative decoding is single-sequence; larger batches already share each forward pass
+                responses = [generate_response(
+                    self.gpt2_model, self.gpt2_tokenizer, queries[0], prompt_cache=self.prompt_cache,
+                    generation_info=generation_info, draft=self.draft
+                )]
+                generation_info["new_tokens"] = [generation_info["new_tokens"]]
+            else:
+                responses = generate_responses(
+                    self.gpt2_model, self.batch_tokenizer, queries, generation_info=generation_info
+                )
+        for new_tokens in generation_info.get("new_tokens", []):
+            self.stats.registry.observe("chatbot_generated_tokens", new_tokens)
+        return responses
+
+    # --- End-to-end answers ---
+
+    def answer(self, query: str):
+        return self.answer_batch([query])[0]
+
+    def answer_batch(self, queries, trace=None):
+        # Each stage runs once over every query that reaches it. The length guard runs alongside
+        # the OOD check, and GLiNER alongside retrieval and generation; trace, if given, receives
+        # the run's critical path (see StageGraph.run).
+        queries = list(queries)
+        results = [
+            {"query": query, "processed_query": None, "is_ood": None, "response": None,
+             "error": None, "cached": False, "retrieved": False}
+            for query in queries
+        ]
+
+        def classify(queries):
+            # On the normalized query, as validate_batch returns it; None for empty queries
+            normalized = [normalize_query(query) for query in queries]
+            non_empty = [i for i, query in enumerate(normalized) if query]
+            flags = [None] * len(queries)
+            computed = self._cached("ood", [normalized[i] for i in non_empty], self._is_ood_uncached)
+            for i, flag in zip(non_empty, computed):
+                flags[i] = flag
+            return flags
+
+        def route(validate, classify):
+            # Too-long queries get the error (their OOD verdict is dropped), OOD queries the fallback
+            # before any spell correction is paid for; the rest go to correction and the response cache.
+            # Returns the indices still needing an answer.
+            valid, in_domain = [], []
+            for i, (processed, error) in enumerate(validate):
+                results[i]["processed_query"] = processed
+                if error:
+                    results[i]["error"] = error
+                    results[i]["response"] = error
+                elif processed:
+                    valid.append(i)
+                    results[i]["is_ood"] = classify[i]
+                    if classify[i]:
+                        results[i]["response"] = random.choice(fallback_responses)
+                    else:
+                        in_domain.append(i)
+            self._count_ood([classify[i] for i in valid])
+            self.stats.skip("spell_correction", len(valid) - len(in_domain))
+
+            corrected = self.correct_batch([results[i]["processed_query"] for i in in_domain])
+            for i, text in zip(in_domain, corrected):
+                results[i]["processed_query"] = text
+
+            to_generate = []
+            for i in in_domain:
+                cached = self.caches["response"].get(normalize_key(results[i]["processed_query"]))
+                if cached is not None:
+                    results[i]["response"] = cached
+                    results[i]["cached"] = True
+                else:
+                    to_generate.append(i)
+            return to_generate
+
+        def placeholders(route):
+            return self.extract_placeholders_batch([results[i]["processed_query"] for i in route])
+
+        def responses(route):
+            # Stored answers for frequent intents; only the rest go to DistilGPT2
+            responses, retrieved = self._retrieve_or_generate([results[i]["processed_query"] for i in route])
+            for i, hit in zip(route, retrieved):
+                results[i]["retrieved"] = hit
+            return responses
+
+        def substitute(route, placeholders, responses):
+            for i, dynamic_placeholders, response in zip(route, placeholders, responses):
+                with self.stats.timer("replace_placeholders"):
+                    results[i]["response"] = self.placeholders.substitute(response, dynamic_placeholders)
+                self.caches["response"].set(normalize_key(results[i]["processed_query"]), results[i]["response"])
+
+        graph = StageGraph("answer", [
+            Stage("validate", self.validate_batch, deps=("queries",)),
+            Stage("classify", classify, deps=("queries",)),
+            Stage("route", route, deps=("validate", "classify")),
+            Stage("placeholders", placeholders, deps=("route",)),
+            Stage("responses", responses, deps=("route",)),
+            Stage("substitute", substitute, deps=("route", "placeholders", "responses")),
+        ], executor=self.stage_executor, registry=self.stats.registry)
+        graph.run(trace=trace, queries=queries)
+        return results
+
+    def _retrieve_or_generate(self, queries):
+        # (response per query, whether it came from the answer index)
+        responses = self.retrieve_batch(queries)
+        misses = [k for k, response in enumerate(responses) if response is None]
+        if not misses: # Every query was answered from the index; don't record an empty generate call
+            return responses, [True] * len(queries)
+        for k, response in zip(misses, self.generate_batch([queries[k] for k in misses])):
+            responses[k] = response
+        missed = set(misses)
+        return responses, [k not in missed for k in range(len(queries))]
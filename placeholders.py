@@ -0,0 +1,143 @@
+import re
+import threading
+import time
+from collections import Counter
+from collections.abc import Mapping
+
+from metrics import METRICS
+
+# =============================
+# PLACEHOLDER SUBSTITUTION
+# =============================
+
+# Any {{NAME}} the response model can emit; names may contain spaces ("{{SUPPORT_ SECTION}}")
+PLACEHOLDER_PATTERN = re.compile(r"\{\{[A-Z0-9_ ]+\}\}")
+# A placeholder that may still be completed by the next streamed token: "{", "{{", "{{NAM", "{{NAME}"
+_PARTIAL_PATTERN = re.compile(r"\{(?:\{[A-Z0-9_ ]*\}?)?\Z")
+# Longest run held back while streaming, even if it still looks like the start of a placeholder
+MIN_HOLD_SPAN = 64
+
+
+def canonical_placeholder(placeholder: str):
+    # "{{SUPPORT_ SECTION}}" and "{{SUPPORT_SECTION}}" name the same template
+    return placeholder.replace(" ", "")
+
+
+class PlaceholderEngine:
+    # Built once from the static templates; rewrites a response in a single regex pass with dict
+    # lookups, so cost grows with the response, not with the number of templates. Static values
+    # win over per-query (dynamic) ones, as with the old chain of str.replace calls. Unknown
+    # placeholders are left in place and counted.
+
+    def __init__(self, static_placeholders):
+        self.static = dict(static_placeholders)
+        self._canonical = {canonical_placeholder(key): value for key, value in self.static.items()}
+        self.max_span = max([MIN_HOLD_SPAN] + [len(key) for key in self.static])
+        self._lock = threading.Lock()
+        self._unknown = Counter()
+
+    def lookup(self, placeholder: str, dynamic_placeholders=None):
+        value = self.static.get(placeholder)
+        if value is None and dynamic_placeholders:
+            value = dynamic_placeholders.get(placeholder)
+        if value is None:
+            canonical = canonical_placeholder(placeholder)
+            value = self._canonical.get(canonical)
+            if value is None and dynamic_placeholders:
+                value = next(
+                    (v for k, v in dynamic_placeholders.items() if canonical_placeholder(k) == canonical), None
+                )
+        return value
+
+    def substitute(self, text: str, dynamic_placeholders=None, placeholder_info=None):
+        # placeholder_info, if given, receives "unknown": placeholders with no value
+        unknown = []
+
+        def replace(match):
+            placeholder = match.group(0)
+            value = self.lookup(placeholder, dynamic_placeholders)
+            if value is None:
+                unknown.append(placeholder)
+                return placeholder
+            return value
+
+        result = PLACEHOLDER_PATTERN.sub(replace, text) if "{{" in text else text
+        if unknown:
+            self._report_unknown(unknown)
+        if placeholder_info is not None:
+            placeholder_info.setdefault("unknown", []).extend(unknown)
+        return result
+
+    def stream(self, chunks, dynamic_placeholders=None, placeholder_info=None):
+        # Incremental substitute(): text is released as soon as it cannot be part of a
+        # placeholder, and a trailing "{{NAM" is held until the next chunk completes or breaks it
+        pending = ""
+        for chunk in chunks:
+            pending += chunk
+            partial = _PARTIAL_PATTERN.search(pending)
+            if partial is not None and len(pending) - partial.start() <= self.max_span:
+                ready, pending = pending[:partial.start()], pending[partial.start():]
+            else:
+                ready, pending = pending, ""
+            if ready:
+                yield self.substitute(ready, dynamic_placeholders, placeholder_info)
+        if pending:
+            yield self.substitute(pending, dynamic_placeholders, placeholder_info)
+
+    def _report_unknown(self, placeholders):
+        with self._lock:
+            new = [p for p in placeholders if p not in self._unknown]
+            self._unknown.update(placeholders)
+        METRICS.inc("chatbot_unknown_placeholders_total", len(placeholders))
+        for placeholder in new:
+            print(f"Unknown placeholder in response: {placeholder}")
+
+    def unknown_placeholders(self):
+        # {placeholder: times seen} for templates the response model uses but nobody mapped
+        with self._lock:
+            return dict(self._unknown)
+
+
+class DeferredPlaceholders(Mapping):
+    # Dynamic placeholders still being extracted (a Future of the dict), so generation can start
+    # alongside GLiNER. Lookups block until the extraction finishes; waited holds the seconds
+    # they spent blocked, i.e. how much of the extraction did not overlap with generation.
+
+    def __init__(self, future):
+        self.future = future
+        self.waited = 0.0
+        self.started = time.perf_counter()
+        self.finished = None
+        self._values = None
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        self.finished = time.perf_counter()
+
+    @property
+    def seconds(self):
+        # Time from creation until the extraction finished, None while it is still running
+        return None if self.finished is None else max(0.0, self.finished - self.started)
+
+    def _resolve(self):
+        if self._values is None:
+            start = time.perf_counter()
+            self._values = self.future.result() or {}
+            self.waited += time.perf_counter() - start
+        return self._values
+
+    def __bool__(self):
+        # Unknown until resolved; the PlaceholderEngine only looks here for placeholders it has no static value for
+        return True
+
+    def __getitem__(self, key):
+        return self._resolve()[key]
+
+    def __iter__(self):
+        return iter(self._resolve())
+
+    def __len__(self):
+        return len(self._resolve())
+
+    def resolve(self):
+        return dict(self._resolve())
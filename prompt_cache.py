@@ -0,0 +1,98 @@
+import copy
+import threading
+from collections import OrderedDict
+import torch
+
+# =============================
+# PROMPT PREFIX KV-CACHE
+# =============================
+
+# Every DistilGPT2 prompt starts with this; its key/value state is computed once
+PROMPT_PREFIX = "Instruction:"
+
+
+class PromptCache:
+    # Keeps past_key_values for the constant prompt prefix and for recently seen prompts.
+    # lookup() returns a private copy covering the longest cached token prefix of a prompt,
+    # so generate() only prefills the tokens after it. store() keeps generate()'s cache,
+    # cropped back to the prompt, for the next identical or near-identical instruction.
+
+    def __init__(self, model, tokenizer, maxsize: int = 32, prefix: str = PROMPT_PREFIX):
+        self.model = model
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # token id tuple -> cache covering exactly those tokens
+        self._stats = {"lookups": 0, "hits": 0, "reused_tokens": 0, "prompt_tokens": 0}
+        self.prefix_ids = tuple(tokenizer(prefix, add_special_tokens=False)["input_ids"])
+        self._prefix_cache = self._prefill(self.prefix_ids)
+
+    def _prefill(self, token_ids):
+        device = next(self.model.parameters()).device
+        input_ids = torch.tensor([token_ids], device=device)
+        with torch.no_grad():
+            outputs = self.model(input_ids=input_ids, use_cache=True)
+        return outputs.past_key_values
+
+    @staticmethod
+    def _common_prefix_length(a, b):
+        n = min(len(a), len(b))
+        i = 0
+        while i < n and a[i] == b[i]:
+            i += 1
+        return i
+
+    def lookup(self, input_ids):
+        # input_ids: 1 x seq_len tensor. Returns (cache or None, number of cached tokens)
+        if input_ids.shape[0] != 1:
+            return None, 0
+        ids = tuple(input_ids[0].tolist())
+        # generate() needs at least one uncached token to produce the first logits
+        limit = len(ids) - 1
+        best_key, best_length = None, 0
+        with self._lock:
+            self._stats["lookups"] += 1
+            self._stats["prompt_tokens"] += len(ids)
+            for key in self._entries:
+                length = min(self._common_prefix_length(key, ids), limit)
+                if length > best_length:
+                    best_key, best_length = key, length
+            if best_key is not None and best_length > len(self.prefix_ids):
+                self._entries.move_to_end(best_key)
+                source = self._entries[best_key]
+            elif ids[:len(self.prefix_ids)] == self.prefix_ids and len(self.prefix_ids) <= limit:
+                source, best_length = self._prefix_cache, len(self.prefix_ids)
+            else:
+                return None, 0
+            self._stats["hits"] += 1
+            self._stats["reused_tokens"] += best_length
+        cache = copy.deepcopy(source)
+        if cache.get_seq_length() > best_length:
+            cache.crop(best_length)
+        return cache, best_length
+
+    def store(self, input_ids, cache):
+        # cache: the past_key_values generate() returned for this prompt (it is cropped in place)
+        if self.maxsize <= 0 or cache is None or input_ids.shape[0] != 1:
+            return
+        ids = tuple(input_ids[0].tolist())
+        key = ids[:-1]
+        if len(key) <= len(self.prefix_ids):
+            return
+        cache.crop(len(key))
+        with self._lock:
+            self._entries[key] = cache
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        stats["reused_token_share"] = stats["reused_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+        return stats
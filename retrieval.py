@@ -0,0 +1,218 @@
+import json
+import os
+import threading
+
+import numpy as np
+import torch
+
+from metrics import METRICS
+
+# =============================
+# RETRIEVAL ANSWER INDEX
+# =============================
+
+# Directory written by `python retrieval.py --out <dir>`; unset turns retrieval off
+ANSWER_INDEX_DIR = os.environ.get("CHATBOT_ANSWER_INDEX")
+# Cosine similarity a query needs to its nearest indexed question to get that intent's answer.
+# `python retrieval.py` prints the highest similarity between questions of different intents.
+RETRIEVAL_THRESHOLD = float(os.environ.get("CHATBOT_RETRIEVAL_THRESHOLD", "0.95"))
+EMBEDDINGS_FILE = "embeddings.npy"
+ANSWERS_FILE = "answers.json"
+
+# Frequent intents and questions that should get their canonical answer. An intent may also
+# carry a fixed "answer"; otherwise the build generates one from its first question.
+INTENTS = {
+    "refund": {"questions": [
+        "How do I get a refund?", "How can I request a refund for my ticket?", "Where is my refund?",
+        "I want my money back for my ticket",
+    ]},
+    "cancel": {"questions": [
+        "How do I cancel my ticket?", "How can I cancel my ticket purchase?", "I want to cancel my ticket",
+    ]},
+    "cancellation_fee": {"questions": [
+        "What is the ticket cancellation fee?", "How much does it cost to cancel a ticket?",
+    ]},
+    "cancellation_status": {"questions": [
+        "How can I track my ticket cancellation status?", "How do I check the status of my cancellation?",
+    ]},
+    "upgrade": {"questions": [
+        "How can I upgrade my ticket?", "Can I upgrade my seat to a better category?",
+    ]},
+    "transfer": {"questions": [
+        "How can I transfer my ticket?", "Can I transfer my ticket to someone else?",
+    ]},
+    "sell": {"questions": [
+        "How can I sell my ticket?", "How do I resell a ticket I cannot use?",
+    ]},
+    "buy": {"questions": [
+        "How do I buy a ticket?", "How can I purchase tickets for an event?",
+    ]},
+    "change_details": {"questions": [
+        "How do I change my personal details on my ticket?", "How can I update the name on my ticket?",
+    ]},
+    "find_events": {"questions": [
+        "How can I find details about upcoming events?", "Where can I see upcoming events?",
+    ]},
+    "contact_support": {"questions": [
+        "How do I contact customer service?", "How can I talk to a support agent?",
+    ]},
+}
+
+
+def pool_embeddings(hidden, attention_mask):
+    # Mean over the real tokens, L2-normalized, as a float32 NumPy array
+    mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+    pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+    return torch.nn.functional.normalize(pooled.float(), dim=-1).cpu().numpy()
+
+
+def embed_queries(queries, model, tokenizer):
+    # Pooled last hidden states of the classifier's DistilBERT encoder
+    encoder = getattr(model, "base_model", None)
+    if encoder is None:
+        raise ValueError("Retrieval needs the classifier's encoder, which torchscript mode does not keep")
+    device = next(model.parameters()).device
+    inputs = tokenizer(list(queries), return_tensors="pt", truncation=True, padding=True, max_length=256)
+    inputs = {k: v.to(device) for k, v in inputs.items() if k in ("input_ids", "attention_mask")}
+    with torch.no_grad():
+        hidden = encoder(**inputs).last_hidden_state
+    return pool_embeddings(hidden, inputs["attention_mask"])
+
+
+class AnswerIndex:
+    # Nearest-neighbour lookup from a query embedding to a stored answer. embeddings holds one
+    # normalized row per indexed question (memory-mapped when loaded from disk), rows[i] names
+    # that question's intent, and answers maps each intent to its templated answer, with
+    # {{PLACEHOLDERS}} left for the PlaceholderEngine.
+
+    def __init__(self, embeddings, rows, answers, threshold: float = RETRIEVAL_THRESHOLD):
+        self.embeddings = embeddings
+        self.rows = rows
+        self.answers = answers
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "hits": 0}
+
+    @classmethod
+    def load(cls, path: str, threshold: float = RETRIEVAL_THRESHOLD):
+        embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+        with open(os.path.join(path, ANSWERS_FILE), encoding="utf-8") as f:
+            data = json.load(f)
+        if len(data["rows"]) != embeddings.shape[0]:
+            raise ValueError(f"{path}: {len(data['rows'])} rows for {embeddings.shape[0]} embeddings")
+        return cls(embeddings, data["rows"], data["answers"], threshold)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, EMBEDDINGS_FILE), np.ascontiguousarray(self.embeddings, dtype=np.float32))
+        with open(os.path.join(path, ANSWERS_FILE), "w", encoding="utf-8") as f:
+            json.dump({"rows": self.rows, "answers": self.answers}, f, indent=2, ensure_ascii=False)
+
+    def nearest(self, query_embeddings):
+        # (row, cosine similarity) of the closest indexed question, per query
+        scores = np.asarray(query_embeddings, dtype=np.float32) @ self.embeddings.T
+        best = scores.argmax(axis=1)
+        return best, scores[np.arange(len(best)), best]
+
+    def search(self, query_embeddings):
+        # The matched intent's answer per query, or None below the threshold
+        best, similarity = self.nearest(query_embeddings)
+        results = [
+            self.answers[self.rows[row]["intent"]] if score >= self.threshold else None
+            for row, score in zip(best.tolist(), similarity.tolist())
+        ]
+        hits = sum(1 for answer in results if answer is not None)
+        with self._lock:
+            self._stats["lookups"] += len(results)
+            self._stats["hits"] += hits
+        if hits:
+            METRICS.inc("chatbot_retrieval_total", hits, result="hit")
+        if len(results) - hits:
+            METRICS.inc("chatbot_retrieval_total", len(results) - hits, result="miss")
+        return results
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        stats["questions"] = len(self.rows)
+        stats["intents"] = len(self.answers)
+        return stats
+
+
+def load_answer_index(path: str = ANSWER_INDEX_DIR, threshold: float = RETRIEVAL_THRESHOLD):
+    if not path:
+        return None
+    try:
+        return AnswerIndex.load(path, threshold)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Answer index not loaded from {path}: {e}")
+        return None
+
+
+def build_answer_index(intents, embed, generate, threshold: float = RETRIEVAL_THRESHOLD):
+    # embed: list of questions -> normalized embeddings. generate: question -> templated answer
+    rows, answers = [], {}
+    for intent, spec in intents.items():
+        answers[intent] = spec.get("answer") or generate(spec["questions"][0])
+        rows.extend({"intent": intent, "question": question} for question in spec["questions"])
+    embeddings = embed([row["question"] for row in rows])
+    return AnswerIndex(embeddings, rows, answers, threshold)
+
+
+def separation_report(index: AnswerIndex):
+    # Highest similarity between questions of different intents (the threshold must clear it),
+    # and the lowest between a question and its nearest question of the same intent
+    embeddings = np.asarray(index.embeddings)
+    scores = embeddings @ embeddings.T
+    np.fill_diagonal(scores, -1.0)
+    intents = np.array([row["intent"] for row in index.rows])
+    same = intents[:, None] == intents[None, :]
+    cross = float(np.where(same, -1.0, scores).max())
+    nearest_same = np.where(same, scores, -1.0).max(axis=1)
+    within = float(nearest_same[nearest_same > -1.0].min()) if (nearest_same > -1.0).any() else None
+    return {"max_cross_intent": cross, "min_within_intent": within}
+
+
+if __name__ == "__main__":
+    # Build the index offline, then point CHATBOT_ANSWER_INDEX at it:
+    #   python retrieval.py --out answer_index
+    #   python retrieval.py --out answer_index --intents intents.json   # {"intent": {"questions": [...], "answer": "..."}}
+    import argparse
+
+    import pipeline
+
+    parser = argparse.ArgumentParser(description="Build the retrieval answer index")
+    parser.add_argument("--out", required=True, help="directory to write the index to")
+    parser.add_argument("--intents", help="JSON file of intents (default: the built-in INTENTS)")
+    parser.add_argument("--tiny", action="store_true", help="use tiny random stand-in models (no downloads)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    intents = INTENTS
+    if args.intents:
+        with open(args.intents, encoding="utf-8") as f:
+            intents = json.load(f)
+    torch.manual_seed(args.seed)
+    if args.tiny:
+        from benchmarks.tiny_models import tiny_pipeline
+        chatbot = tiny_pipeline(seed=args.seed)
+    else:
+        chatbot = pipeline.ChatbotPipeline.from_pretrained()
+    index = build_answer_index(
+        intents,
+        # Questions are embedded the way queries reach retrieval: normalized like every query
+        lambda questions: embed_queries(
+            [pipeline.normalize_query(question) for question in questions], chatbot.clf_model, chatbot.clf_tokenizer
+        ),
+        lambda question: pipeline.generate_response(chatbot.gpt2_model, chatbot.gpt2_tokenizer, question),
+    )
+    index.save(args.out)
+    for intent, answer in index.answers.items():
+        print(f"{intent}: {answer}\n")
+    report = separation_report(index)
+    print(f"{len(index.rows)} questions, {len(index.answers)} intents written to {args.out}")
+    print(f"Most similar questions of different intents: {report['max_cross_intent']:.3f}")
+    if report["min_within_intent"] is not None:
+        print(f"Least similar question to the rest of its intent: {report['min_within_intent']:.3f}")
+    print(f"CHATBOT_RETRIEVAL_THRESHOLD is {RETRIEVAL_THRESHOLD} and must be above the first figure")
@@ -0,0 +1,228 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+# =============================
+# MICRO-BATCHING SCHEDULER
+# =============================
+
+BUSY_MESSAGE = "⚠️ The assistant is handling a lot of questions right now. Please try again in a moment."
+# Threads running generate/answer batches and streamed answers; each stream holds one until it ends
+GENERATION_WORKERS = int(os.environ.get("CHATBOT_GENERATION_WORKERS", "2"))
+
+# Scheduler stage name -> batched ChatbotPipeline method
+STAGES = {
+    "validate": "validate_batch",
+    "correct": "correct_batch",
+    "preprocess": "preprocess_batch",
+    "is_ood": "is_ood_batch",
+    "placeholders": "extract_placeholders_batch",
+    "generate": "generate_batch",
+    "answer": "answer_batch",
+}
+# Stages that run DistilGPT2. They get their own queue and workers, so a validate or OOD batch
+# never waits behind a generation.
+GENERATION_STAGES = ("generate", "answer")
+
+_STREAM = "stream"
+_STOP = object()
+_DONE = object()
+
+
+class SchedulerBusy(Exception):
+    pass
+
+
+class BatchScheduler:
+    # Requests from every session are collected for up to max_wait_ms (or until max_batch_size),
+    # then each stage runs once over the whole batch. Two lanes, each with its own queue: one
+    # worker for the short stages, generation_workers for generate/answer batches and streams.
+    # Streams are never batched.
+
+    def __init__(self, pipeline, max_batch_size: int = 16, max_wait_ms: float = 5.0,
+                 max_queue_size: int = 128, result_timeout: float = 120.0,
+                 generation_workers: int = GENERATION_WORKERS):
+        self.pipeline = pipeline
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.result_timeout = result_timeout
+        self._queues = {
+            "short": queue.Queue(maxsize=max_queue_size),
+            "generation": queue.Queue(maxsize=max_queue_size),
+        }
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "rejected": 0, "batches": 0, "batched_requests": 0, "errors": 0}
+        lanes = ["short"] + ["generation"] * max(1, generation_workers)
+        self._workers = [
+            (lane, threading.Thread(target=self._run, args=(lane,), name=f"batch-{lane}-{i}", daemon=True))
+            for i, lane in enumerate(lanes)
+        ]
+        for _, worker in self._workers:
+            worker.start()
+
+    # --- Client side ---
+
+    def _enqueue(self, stage: str, payload):
+        lane = "generation" if stage in GENERATION_STAGES or stage == _STREAM else "short"
+        future = Future()
+        try:
+            self._queues[lane].put_nowait((stage, payload, future))
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise SchedulerBusy(BUSY_MESSAGE)
+        with self._lock:
+            self._stats["requests"] += 1
+        return future
+
+    def submit(self, stage: str, payload):
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage: {stage}")
+        return self._enqueue(stage, payload)
+
+    def call(self, stage: str, payload):
+        future = self.submit(stage, payload)
+        try:
+            return future.result(timeout=self.result_timeout)
+        except FutureTimeout:
+            future.cancel() # Skipped if no worker has picked it up yet; a running batch still finishes
+            raise
+
+    def validate(self, query: str):
+        return self.call("validate", query)
+
+    def correct(self, query: str):
+        return self.call("correct", query)
+
+    def preprocess(self, query: str):
+        return self.call("preprocess", query)
+
+    def is_ood(self, query: str):
+        return self.call("is_ood", query)
+
+    def extract_placeholders(self, query: str):
+        return self.call("placeholders", query)
+
+    def answer(self, query: str):
+        return self.call("answer", query)
+
+    def stream_response(self, query: str, dynamic_placeholders=None, started_at: float = None):
+        # ChatbotPipeline.stream_response on a generation worker, so streamed answers share the
+        # generation lane's admission control. Closing this generator early stops the generation.
+        chunks = queue.Queue()
+        stop = threading.Event()
+        future = self._enqueue(_STREAM, (query, dynamic_placeholders, started_at, chunks, stop))
+        try:
+            while True:
+                try:
+                    item = chunks.get(timeout=self.result_timeout)
+                except queue.Empty:
+                    future.cancel()
+                    raise TimeoutError(f"No output from the generation worker for {self.result_timeout:g}s")
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            stop.set()
+        future.result() # Raises the stream's error, if any
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queue_size"] = sum(q.qsize() for q in self._queues.values())
+        stats["generation_queue_size"] = self._queues["generation"].qsize()
+        stats["avg_batch_size"] = stats["batched_requests"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+    def shutdown(self, wait: bool = True):
+        # Blocks until each worker's queue has room for its sentinel, so queued requests still run
+        for lane, _ in self._workers:
+            self._queues[lane].put(_STOP)
+        if wait:
+            for _, worker in self._workers:
+                worker.join()
+
+    # --- Worker side ---
+
+    def _collect_batch(self, lane, first):
+        # Returns (batch, the stream or stop item that ended it early, or None)
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queues[lane].get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP or item[0] == _STREAM:
+                # Finish this batch, then handle the item next. Putting it back could block on a
+                # full queue and would send it behind newer requests.
+                return batch, item
+            batch.append(item)
+        return batch, None
+
+    def _run(self, lane):
+        held = None
+        while True:
+            if held is not None:
+                first, held = held, None
+            else:
+                first = self._queues[lane].get()
+            if first is _STOP:
+                return
+            if first[0] == _STREAM:
+                self._run_stream(*first[1:])
+                continue
+            batch, held = self._collect_batch(lane, first)
+            with self._lock:
+                self._stats["batches"] += 1
+                self._stats["batched_requests"] += len(batch)
+
+            by_stage = {}
+            for stage, payload, future in batch:
+                # Callers that timed out and cancelled no longer need the work
+                if future.set_running_or_notify_cancel():
+                    by_stage.setdefault(stage, []).append((payload, future))
+
+            for stage, items in by_stage.items():
+                self._run_stage(stage, items)
+
+    def _run_stage(self, stage, items):
+        payloads = [payload for payload, _ in items]
+        try:
+            results = getattr(self.pipeline, STAGES[stage])(payloads)
+        except Exception as e:
+            with self._lock:
+                self._stats["errors"] += 1
+            for _, future in items:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(items, results):
+            future.set_result(result)
+
+    def _run_stream(self, payload, future):
+        query, dynamic_placeholders, started_at, chunks, stop = payload
+        if not future.set_running_or_notify_cancel():
+            return
+        if stop.is_set(): # Gave up while the stream was queued
+            future.set_result(None)
+            return
+        # stop doubles as the generation's cancel flag, so a reader going away stops it at the next token
+        tokens = self.pipeline.stream_response(query, dynamic_placeholders, started_at, cancelled=stop)
+        try:
+            for text in tokens:
+                if stop.is_set(): # The reader went away
+                    break
+                chunks.put(text)
+            future.set_result(None)
+        except Exception as e:
+            with self._lock:
+                self._stats["errors"] += 1
+            future.set_exception(e)
+        finally:
+            tokens.close()
+            chunks.put(_DONE)
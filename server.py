@@ -0,0 +1,313 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+from contextlib import aclosing, closing
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from metrics import METRICS
+from pipeline import ChatbotPipeline, fallback_responses
+from scheduler import BatchScheduler, SchedulerBusy
+
+# =============================
+# SERVICE CONFIGURATION
+# =============================
+
+SERVICE_HOST = os.environ.get("CHATBOT_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.environ.get("CHATBOT_SERVICE_PORT", "8000"))
+# Threads that run streamed DistilGPT2 generations; further streams wait for a free one
+STREAM_WORKERS = int(os.environ.get("CHATBOT_SERVICE_STREAMS", "4"))
+# Inference worker processes forked after the models load (0 runs inference in this process)
+SERVICE_WORKERS = int(os.environ.get("CHATBOT_SERVICE_WORKERS", "0"))
+
+MAX_BODY_BYTES = 64 * 1024
+HEADER_TIMEOUT = 10.0
+# Models every request needs; /health reports "loading" until they are in memory
+REQUIRED_MODELS = ("gpt2_tokenizer", "classifier")
+
+
+class BadRequest(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+# =============================
+# HTTP PLUMBING
+# =============================
+
+async def read_request(reader):
+    # (method, path, headers, body) for one HTTP/1.1 request
+    request_line = await reader.readline()
+    if not request_line:
+        raise ConnectionError("Client closed the connection")
+    try:
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise BadRequest(HTTPStatus.BAD_REQUEST, "Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise BadRequest(HTTPStatus.BAD_REQUEST, "Malformed Content-Length")
+    if length < 0:
+        raise BadRequest(HTTPStatus.BAD_REQUEST, "Malformed Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise BadRequest(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target.split("?", 1)[0], headers, body
+
+
+async def send_response(writer, status: HTTPStatus, body: bytes, content_type: str):
+    head = (
+        f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+    )
+    writer.write(head.encode("latin-1") + body)
+    await writer.drain()
+
+
+async def send_json(writer, status: HTTPStatus, payload):
+    await send_response(writer, status, json.dumps(payload).encode("utf-8"), "application/json")
+
+
+async def send_event_stream(writer, events):
+    # Server-sent events over chunked transfer encoding; events yields (event name, JSON payload)
+    head = (
+        "HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+        "Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n"
+    )
+    writer.write(head.encode("latin-1"))
+
+    def write_event(event, payload):
+        data = f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode("utf-8")
+        writer.write(f"{len(data):X}\r\n".encode("latin-1") + data + b"\r\n")
+
+    try:
+        # If the client disconnects, closing the events cancels the generation at its next token
+        # (in a WorkerPool worker too)
+        async with aclosing(events):
+            async for event, payload in events:
+                write_event(event, payload)
+                await writer.drain()
+    except ConnectionError:
+        raise
+    except Exception as e:
+        # The 200 head is already sent, so the failure goes out as an event, not a 500 response
+        print(f"Service error: {e}")
+        METRICS.inc("chatbot_errors_total", stage="service")
+        write_event("error", {"error": "Internal error"})
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+def parse_query(body: bytes):
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        raise BadRequest(HTTPStatus.BAD_REQUEST, "Body must be JSON")
+    query = payload.get("query") if isinstance(payload, dict) else None
+    if not isinstance(query, str) or not query.strip():
+        raise BadRequest(HTTPStatus.BAD_REQUEST, 'Body must be {"query": "<non-empty string>"}')
+    return query, payload
+
+# =============================
+# CHATBOT SERVICE
+# =============================
+
+class ChatbotService:
+    # Batched stages go through the shared BatchScheduler and are awaited as futures, so the
+    # event loop never blocks on a model. Streamed generation goes through the scheduler's
+    # generation lane, relayed by a bounded thread pool. A WorkerPool can replace both:
+    # scheduler=pool, streamer=pool.
+
+    def __init__(self, chatbot, scheduler=None, stream_workers: int = STREAM_WORKERS, streamer=None):
+        self.chatbot = chatbot
+        self.scheduler = scheduler if scheduler is not None else BatchScheduler(chatbot)
+        self.streamer = streamer if streamer is not None else self.scheduler # Has stream_response()
+        self.executor = ThreadPoolExecutor(max_workers=stream_workers, thread_name_prefix="stream")
+        self.routes = {
+            ("GET", "/health"): self.health,
+            ("GET", "/metrics"): self.metrics,
+            ("POST", "/classify"): self.classify,
+            ("POST", "/answer"): self.answer,
+        }
+
+    async def call(self, stage: str, payload):
+        return await asyncio.wrap_future(self.scheduler.submit(stage, payload))
+
+    async def handle_connection(self, reader, writer):
+        try:
+            method, path, headers, body = await asyncio.wait_for(read_request(reader), HEADER_TIMEOUT)
+            handler = self.routes.get((method, path))
+            if handler is None:
+                known_path = any(route_path == path for _, route_path in self.routes)
+                status = HTTPStatus.METHOD_NOT_ALLOWED if known_path else HTTPStatus.NOT_FOUND
+                raise BadRequest(status, f"No route for {method} {path}")
+            await handler(writer, headers, body)
+        except BadRequest as e:
+            await send_json(writer, e.status, {"error": str(e)})
+        except SchedulerBusy as e:
+            await send_json(writer, HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass # Client went away or never sent a full request
+        except Exception as e:
+            print(f"Service error: {e}")
+            METRICS.inc("chatbot_errors_total", stage="service")
+            try:
+                await send_json(writer, HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal error"})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    # --- Endpoints ---
+
+    async def health(self, writer, headers, body):
+        loaded = {name: self.chatbot.models.is_loaded(name) for name in self.chatbot.models.names()}
+        ready = all(loaded.get(name, False) for name in REQUIRED_MODELS)
+        await send_json(
+            writer, HTTPStatus.OK if ready else HTTPStatus.SERVICE_UNAVAILABLE,
+            {"status": "ok" if ready else "loading", "models": loaded, "scheduler": self.scheduler.stats()}
+        )
+
+    async def metrics(self, writer, headers, body):
+        await send_response(
+            writer, HTTPStatus.OK, METRICS.render_prometheus().encode("utf-8"),
+            "text/plain; version=0.0.4; charset=utf-8"
+        )
+
+    async def classify(self, writer, headers, body):
+        # Length guard and OOD classification only
+        query, _ = parse_query(body)
+        processed, error = await self.call("validate", query)
+        is_ood = None if error else await self.call("is_ood", processed)
+        await send_json(writer, HTTPStatus.OK, {
+            "query": query, "processed_query": processed, "is_ood": is_ood, "error": error
+        })
+
+    async def answer(self, writer, headers, body):
+        query, payload = parse_query(body)
+        stream = payload.get("stream") or "text/event-stream" in headers.get("accept", "")
+        if not stream:
+            result = await self.call("answer", query)
+            await send_json(writer, HTTPStatus.OK, result)
+            return
+        await send_event_stream(writer, self.answer_events(query))
+
+    async def answer_events(self, query):
+        # meta (once the route is known), token chunks, then done with the full result
+        result = {"query": query, "processed_query": None, "is_ood": None, "response": None,
+                  "error": None, "cached": False}
+        try:
+            processed, error = await self.call("validate", query)
+            result["processed_query"] = processed
+            if error:
+                result["error"] = result["response"] = error
+                yield "done", result
+                return
+            result["is_ood"] = await self.call("is_ood", processed)
+            if result["is_ood"]:
+                result["response"] = random.choice(fallback_responses)
+                yield "meta", {"processed_query": processed, "is_ood": True}
+                yield "token", {"text": result["response"]}
+                yield "done", result
+                return
+            processed = await self.call("correct", processed)
+            result["processed_query"] = processed
+            yield "meta", {"processed_query": processed, "is_ood": False}
+            # Not awaited: generation starts while GLiNER runs. A WorkerPool extracts them itself,
+            # alongside generation in the worker.
+            dynamic_placeholders = None
+            if isinstance(self.streamer, BatchScheduler):
+                dynamic_placeholders = self.scheduler.submit("placeholders", processed)
+            chunks = []
+            async for text in self.stream_tokens(processed, dynamic_placeholders):
+                chunks.append(text)
+                yield "token", {"text": text}
+            result["response"] = "".join(chunks).strip()
+            yield "done", result
+        except SchedulerBusy as e:
+            yield "error", {"error": str(e)}
+
+    async def stream_tokens(self, query, dynamic_placeholders):
+        # Runs ChatbotPipeline.stream_response on the stream pool and hands chunks to the event loop
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        done = object()
+        cancelled = False
+
+        def produce():
+            try:
+                # Closing the stream early stops ChatbotPipeline's generation (see pipeline.stream_response)
+                with closing(self.streamer.stream_response(query, dynamic_placeholders)) as tokens:
+                    for text in tokens:
+                        if cancelled:
+                            break
+                        loop.call_soon_threadsafe(chunks.put_nowait, text)
+                loop.call_soon_threadsafe(chunks.put_nowait, done)
+            except Exception as e:
+                loop.call_soon_threadsafe(chunks.put_nowait, e)
+
+        producer = loop.run_in_executor(self.executor, produce)
+        try:
+            while True:
+                item = await chunks.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            cancelled = True # Stop forwarding if the client disconnected
+            await asyncio.shield(producer)
+
+    def shutdown(self):
+        self.scheduler.shutdown(wait=False)
+        self.executor.shutdown(wait=False)
+
+
+async def serve(service, host: str = SERVICE_HOST, port: int = SERVICE_PORT):
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print(f"Chatbot service listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    # python server.py --port 8000, then e.g.
+    #   curl -s localhost:8000/answer -d '{"query": "How do I get a refund?"}'
+    #   curl -N localhost:8000/answer -d '{"query": "How do I get a refund?", "stream": true}'
+    parser = argparse.ArgumentParser(description="Async HTTP/JSON service for the ticketing chatbot")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS, help="inference worker processes")
+    parser.add_argument("--tiny", action="store_true", help="serve tiny random stand-in models (no downloads)")
+    args = parser.parse_args()
+
+    if args.tiny:
+        from benchmarks.tiny_models import tiny_pipeline
+        chatbot = tiny_pipeline()
+    else:
+        chatbot = ChatbotPipeline.from_pretrained()
+    if args.workers > 0:
+        from workers import WorkerPool
+        # Workers fork once every model is loaded, so they share the weights
+        pool = WorkerPool(chatbot, args.workers)
+        service = ChatbotService(chatbot, scheduler=pool, streamer=pool)
+    else:
+        chatbot.preload(wait=False) # Serve /health while the models load
+        service = ChatbotService(chatbot)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.shutdown()
@@ -0,0 +1,194 @@
+import os
+import threading
+from collections import deque
+
+import torch
+from transformers import (
+    DynamicCache, LogitsProcessorList, StoppingCriteriaList,
+    TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper
+)
+from transformers.generation import GenerateDecoderOnlyOutput
+
+from metrics import METRICS
+
+# =============================
+# SPECULATIVE DECODING
+# =============================
+
+# "standard" decodes one token per forward pass; "ngram" drafts tokens from past responses
+# and verifies them in one pass (single-query generation only; batches use standard decoding)
+DECODING_MODES = ("standard", "ngram")
+DECODING_MODE = os.environ.get("CHATBOT_DECODING", "standard")
+# Longest draft verified per forward pass
+DRAFT_TOKENS = int(os.environ.get("CHATBOT_DRAFT_TOKENS", "8"))
+# Optional text file of past responses, one per line, to start the draft corpus from
+DRAFT_CORPUS = os.environ.get("CHATBOT_DRAFT_CORPUS")
+# Longest context suffix matched against the corpus; shorter ones are tried if it misses
+MAX_NGRAM = 4
+DEFAULT_TOP_K = 50 # generate()'s default when the model's generation config sets none
+
+
+class NgramDraft:
+    # Drafts the next tokens by finding the longest suffix of the context (up to max_ngram
+    # tokens) that occurs in a corpus of past prompt + response token sequences, and copying
+    # what followed its newest occurrence. The context itself is searched as well (prompt
+    # lookup). Every finished generation is added, so templated answers are soon drafted whole.
+    # The oldest sequences are dropped once the corpus holds more than max_tokens tokens.
+
+    def __init__(self, max_ngram: int = MAX_NGRAM, max_draft: int = DRAFT_TOKENS, max_tokens: int = 200_000):
+        self.max_ngram = max_ngram
+        self.max_draft = max_draft
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._sequences = deque()
+        self._tokens = 0
+        self._index = {} # n-gram tuple -> (sequence, position after the n-gram)
+        self._stats = {"sequences_added": 0, "steps": 0, "drafted_tokens": 0, "accepted_tokens": 0}
+
+    @classmethod
+    def from_texts(cls, tokenizer, texts, **kwargs):
+        draft = cls(**kwargs)
+        for text in texts:
+            if text.strip():
+                # Responses follow "Response:", so their first word carries a leading space
+                draft.add(tokenizer(" " + text.strip(), add_special_tokens=False)["input_ids"])
+        return draft
+
+    @classmethod
+    def from_file(cls, tokenizer, path: str, **kwargs):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return cls.from_texts(tokenizer, f, **kwargs)
+        except OSError as e:
+            print(f"Draft corpus error: {e}")
+            return cls(**kwargs)
+
+    def _index_sequence(self, sequence):
+        for n in range(1, self.max_ngram + 1):
+            for end in range(n, len(sequence)):
+                self._index[tuple(sequence[end - n:end])] = (sequence, end)
+
+    def add(self, token_ids):
+        sequence = tuple(token_ids)
+        if len(sequence) < 2:
+            return
+        with self._lock:
+            self._sequences.append(sequence)
+            self._tokens += len(sequence)
+            self._stats["sequences_added"] += 1
+            if self._tokens <= self.max_tokens:
+                self._index_sequence(sequence)
+                return
+            # Drop the oldest quarter at once, so the index is rebuilt rarely
+            while self._tokens > self.max_tokens * 3 // 4 and len(self._sequences) > 1:
+                self._tokens -= len(self._sequences.popleft())
+            self._index = {}
+            for kept in self._sequences:
+                self._index_sequence(kept)
+
+    def propose(self, context, limit: int = None):
+        # Up to limit (default max_draft) token ids likely to follow context, or []
+        limit = self.max_draft if limit is None else min(limit, self.max_draft)
+        if limit <= 0:
+            return []
+        for n in range(min(self.max_ngram, len(context) - 1), 0, -1):
+            suffix = tuple(context[-n:])
+            with self._lock:
+                match = self._index.get(suffix)
+            if match is not None:
+                sequence, start = match
+                return list(sequence[start:start + limit])
+            # Prompt lookup: the newest earlier occurrence in the context itself
+            for start in range(len(context) - n - 1, -1, -1):
+                if tuple(context[start:start + n]) == suffix:
+                    return list(context[start + n:start + n + limit])
+        return []
+
+    def record(self, drafted: int, accepted: int):
+        with self._lock:
+            self._stats["steps"] += 1
+            self._stats["drafted_tokens"] += drafted
+            self._stats["accepted_tokens"] += accepted
+        if drafted:
+            METRICS.inc("chatbot_draft_tokens_total", accepted, result="accepted")
+            METRICS.inc("chatbot_draft_tokens_total", drafted - accepted, result="rejected")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["sequences"] = len(self._sequences)
+            stats["tokens"] = self._tokens
+        stats["acceptance_rate"] = stats["accepted_tokens"] / stats["drafted_tokens"] if stats["drafted_tokens"] else 0.0
+        # Tokens produced per forward pass: the accepted draft tokens plus the one the model picks
+        stats["tokens_per_step"] = (stats["accepted_tokens"] + stats["steps"]) / stats["steps"] if stats["steps"] else 0.0
+        return stats
+
+
+def sampling_warpers(model, temperature: float, top_p: float):
+    # Same warpers, in the same order, as generate(do_sample=True, temperature=..., top_p=...)
+    top_k = model.generation_config.top_k or DEFAULT_TOP_K
+    return LogitsProcessorList([
+        TemperatureLogitsWarper(temperature), TopKLogitsWarper(top_k), TopPLogitsWarper(top_p)
+    ])
+
+
+def speculative_generate(model, input_ids, draft, max_length: int, eos_token_id: int, stopping_criteria=None,
+                         past_key_values=None, do_sample: bool = True, temperature: float = 0.5,
+                         top_p: float = 0.95, streamer=None):
+    # Single-sequence replacement for model.generate(..., return_dict_in_generate=True).
+    # Each step feeds the last token plus a draft through the model once and keeps the draft
+    # up to the first token the model would not have produced itself, plus the model's own
+    # token at that position. Greedy decoding gives the same tokens as generate(); with
+    # sampling, a draft token is kept only if it is the token sampled from the model's
+    # distribution, so the output distribution is unchanged.
+    if input_ids.shape[0] != 1:
+        raise ValueError("speculative_generate handles one sequence at a time")
+    stopping_criteria = stopping_criteria if stopping_criteria is not None else StoppingCriteriaList()
+    warpers = sampling_warpers(model, temperature, top_p) if do_sample else None
+    cache = past_key_values if past_key_values is not None else DynamicCache()
+    sequence = input_ids
+    device = input_ids.device
+    # The cache always covers every token but the last, which starts the next step
+    cached = cache.get_seq_length()
+    if cached < sequence.shape[1] - 1:
+        model(input_ids=sequence[:, cached:-1], past_key_values=cache, use_cache=True)
+    if streamer is not None:
+        streamer.put(sequence.cpu())
+
+    done = sequence.shape[1] >= max_length
+    while not done:
+        context = sequence[0].tolist()
+        proposal = draft.propose(context, limit=max_length - len(context) - 1)
+        step_ids = torch.tensor([context[-1:] + proposal], device=device)
+        logits = model(input_ids=step_ids, past_key_values=cache, use_cache=True).logits[0].float()
+
+        new_tokens, accepted = [], 0
+        for i in range(len(proposal) + 1):
+            if do_sample:
+                scores = warpers(torch.tensor([context + new_tokens], device=device), logits[i:i + 1])
+                token = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1).item()
+            else:
+                token = logits[i].argmax().item()
+            new_tokens.append(token)
+            if i == len(proposal) or token != proposal[i]:
+                break
+            accepted += 1
+        draft.record(len(proposal), accepted)
+
+        # Stopping is checked after every token, as generate() does
+        emitted = []
+        for token in new_tokens:
+            emitted.append(token)
+            sequence = torch.cat([sequence, torch.tensor([[token]], device=device)], dim=1)
+            if (token == eos_token_id or sequence.shape[1] >= max_length
+                    or bool(stopping_criteria(sequence, None).any())):
+                done = True
+                break
+        cache.crop(sequence.shape[1] - 1)
+        if streamer is not None:
+            streamer.put(torch.tensor(emitted))
+
+    if streamer is not None:
+        streamer.end()
+    draft.add(sequence[0].tolist())
+    return GenerateDecoderOnlyOutput(sequences=sequence, past_key_values=cache)
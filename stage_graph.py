@@ -0,0 +1,114 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import torch
+
+from metrics import METRICS
+
+# =============================
+# STAGE DEPENDENCY GRAPH
+# =============================
+
+# Threads that run independent stages side by side (0 runs every stage in the calling thread)
+STAGE_THREADS = int(os.environ.get("CHATBOT_STAGE_THREADS", "4"))
+# Intra-op torch threads for each stage thread. 0 splits the creating thread's count between
+# the (at most two) stages answer_batch runs side by side.
+STAGE_TORCH_THREADS = int(os.environ.get("CHATBOT_STAGE_TORCH_THREADS", "0"))
+BRANCHES = 2
+
+
+class Stage:
+    # fn is called with the results of its deps as keyword arguments (plus any graph inputs it
+    # names in deps)
+
+    def __init__(self, name: str, fn, deps=()):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+
+
+def record_critical_path(graph: str, path, overlap_seconds: float, registry=METRICS):
+    # path: [(stage, seconds)] along the longest chain of dependent stages
+    registry.observe("chatbot_critical_path_seconds", sum(seconds for _, seconds in path), graph=graph)
+    for stage, seconds in path:
+        registry.observe("chatbot_critical_path_stage_seconds", seconds, graph=graph, stage=stage)
+    registry.observe("chatbot_stage_overlap_seconds", max(0.0, overlap_seconds), graph=graph)
+
+
+class StageGraph:
+    # Runs each stage as soon as the stages it depends on have finished, so independent stages
+    # run concurrently on the executor (torch releases the GIL inside its kernels). With no
+    # executor, stages run one after another in the calling thread. After each run the critical
+    # path (the chain of stages that set the end-to-end time) goes to the metrics.
+
+    def __init__(self, name: str, stages, executor=None, registry=METRICS):
+        self.name = name
+        self.stages = {stage.name: stage for stage in stages}
+        self.executor = executor
+        self.registry = registry
+
+    def _call(self, stage, results):
+        kwargs = {dep: results[dep] for dep in stage.deps}
+        start = time.perf_counter()
+        value = stage.fn(**kwargs)
+        return value, start, time.perf_counter()
+
+    def run(self, trace=None, **inputs):
+        # Returns {stage or input name: result}. trace, if given, receives "critical_path"
+        # ([(stage, seconds)]) and "stage_seconds" ({stage: seconds}).
+        results = dict(inputs)
+        timings = {}
+        remaining = dict(self.stages)
+        running = {}
+        while remaining or running:
+            ready = [stage for stage in remaining.values() if all(dep in results for dep in stage.deps)]
+            if not ready and not running:
+                raise ValueError(f"{self.name}: unsatisfiable dependencies for {sorted(remaining)}")
+            for stage in ready:
+                del remaining[stage.name]
+                if self.executor is None:
+                    results[stage.name], *timings[stage.name] = self._call(stage, results)
+                else:
+                    running[self.executor.submit(self._call, stage, results)] = stage.name
+            if running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    results[name], *timings[name] = future.result()
+        self._report(timings, trace)
+        return results
+
+    def _report(self, timings, trace):
+        if not timings:
+            return
+        # Walk back from the stage that finished last, each time through the dependency that
+        # finished last (the one the stage actually waited for)
+        path = []
+        name = max(timings, key=lambda stage: timings[stage][1])
+        while name is not None:
+            start, end = timings[name]
+            path.append((name, end - start))
+            deps = [dep for dep in self.stages[name].deps if dep in timings]
+            name = max(deps, key=lambda dep: timings[dep][1]) if deps else None
+        path.reverse()
+        stage_seconds = {stage: end - start for stage, (start, end) in timings.items()}
+        critical = sum(seconds for _, seconds in path)
+        record_critical_path(self.name, path, sum(stage_seconds.values()) - critical, self.registry)
+        if trace is not None:
+            trace["critical_path"] = path
+            trace["stage_seconds"] = stage_seconds
+
+
+def stage_executor(threads: int = STAGE_THREADS, torch_threads: int = STAGE_TORCH_THREADS):
+    # With torch's OpenMP backend the intra-op thread count is kept per thread: set_num_threads in
+    # one thread leaves the others' counts alone. Each stage thread therefore sets a fixed count
+    # once, when it starts, and the caller's own count is unchanged. The default split is read
+    # from the thread creating the pool, e.g. a WorkerPool worker after its per-process setting.
+    if threads <= 0:
+        return None
+    if torch_threads <= 0:
+        torch_threads = max(1, torch.get_num_threads() // BRANCHES)
+    return ThreadPoolExecutor(
+        max_workers=threads, thread_name_prefix="stage", initializer=torch.set_num_threads, initargs=(torch_threads,)
+    )
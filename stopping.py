@@ -0,0 +1,236 @@
+import os
+import re
+import time
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+from metrics import METRICS
+
+# =============================
+# GENERATION STOPPING CRITERIA
+# =============================
+
+# Soft token budget: TOKEN_BUDGET_BASE + TOKENS_PER_PROMPT_TOKEN per prompt token. Past it,
+# generation stops at the next sentence end; HARD_BUDGET_FACTOR times it, it stops outright.
+# A typical 15-token prompt gets 109 tokens, 136 at most (max_length=256 leaves it ~240).
+TOKEN_BUDGET_BASE = int(os.environ.get("CHATBOT_TOKEN_BUDGET", "64"))
+TOKENS_PER_PROMPT_TOKEN = float(os.environ.get("CHATBOT_TOKENS_PER_PROMPT_TOKEN", "3"))
+HARD_BUDGET_FACTOR = float(os.environ.get("CHATBOT_HARD_BUDGET_FACTOR", "1.25"))
+# Seconds a generation may run before the partial answer is returned (0 disables)
+GENERATION_DEADLINE = float(os.environ.get("CHATBOT_GENERATION_DEADLINE", "15"))
+# A generated n-gram (outside placeholders) seen this many times already means the model is
+# looping. Off (0) until checked against real answers: python -m benchmarks.stopping
+REPEAT_NGRAM_SIZE = int(os.environ.get("CHATBOT_REPEAT_NGRAM_SIZE", "4"))
+MAX_NGRAM_REPEATS = int(os.environ.get("CHATBOT_MAX_NGRAM_REPEATS", "0"))
+# The fine-tuned model sometimes starts a new training example after its answer
+TEMPLATE_MARKERS = ("Instruction:", "Response:")
+SENTENCE_END = re.compile(r"[.!?)]\s*$")
+# A placeholder cut off by an early stop: "{{CANCEL_TICK", "{{NAME}"
+UNCLOSED_PLACEHOLDER = re.compile(r"\{\{[^{}]*\}?\s*$")
+# Stops that can leave an unfinished sentence or placeholder for trim_response to drop
+CUT_SHORT = ("token_budget", "deadline", "max_length", "repeated_ngram")
+# Generated tokens decoded per check; enough to hold any template marker
+_TAIL_TOKENS = 12
+# Characters of decoded text kept per row to tell whether a token is inside a placeholder
+_PLACEHOLDER_TAIL = 64
+
+
+class _RecordingCriterion(StoppingCriteria):
+    # Each criterion records, per batch row, the first reason that row was stopped for. In a batch
+    # the criteria keep seeing rows that already ended at EOS (then padded with EOS); those are
+    # left for record_stop_reasons to report as "eos".
+    name = None
+    eos_token_id = None
+
+    def __init__(self, prompt_length: int, stop_reasons: dict):
+        self.prompt_length = prompt_length
+        self.stop_reasons = stop_reasons
+
+    def check(self, input_ids):
+        raise NotImplementedError
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = self.check(input_ids)
+        rows = done.nonzero().flatten().tolist()
+        if rows and self.eos_token_id is not None:
+            finished = (input_ids[:, self.prompt_length:] == self.eos_token_id).any(dim=1).tolist()
+            rows = [row for row in rows if not finished[row]]
+        for row in rows:
+            self.stop_reasons.setdefault(row, self.name)
+        return done
+
+
+class TokenBudgetCriteria(_RecordingCriterion):
+    name = "token_budget"
+
+    def __init__(self, prompt_length, stop_reasons, tokenizer, budgets):
+        super().__init__(prompt_length, stop_reasons)
+        self.tokenizer = tokenizer
+        self.budgets = budgets # Soft budget per row
+
+    def check(self, input_ids):
+        generated = input_ids.shape[1] - self.prompt_length
+        done = []
+        for row, budget in enumerate(self.budgets):
+            if generated >= int(budget * HARD_BUDGET_FACTOR):
+                done.append(True)
+            elif generated >= budget:
+                # Past the soft budget, finish the current sentence
+                tail = self.tokenizer.decode(input_ids[row, -2:], skip_special_tokens=True)
+                done.append(bool(SENTENCE_END.search(tail)))
+            else:
+                done.append(False)
+        return torch.tensor(done, device=input_ids.device)
+
+
+class TemplateMarkerCriteria(_RecordingCriterion):
+    name = "template_marker"
+
+    def __init__(self, prompt_length, stop_reasons, tokenizer, markers=TEMPLATE_MARKERS):
+        super().__init__(prompt_length, stop_reasons)
+        self.tokenizer = tokenizer
+        self.markers = markers
+
+    def check(self, input_ids):
+        start = max(self.prompt_length, input_ids.shape[1] - _TAIL_TOKENS)
+        tails = self.tokenizer.batch_decode(input_ids[:, start:], skip_special_tokens=True)
+        return torch.tensor(
+            [any(marker in tail for marker in self.markers) for tail in tails], device=input_ids.device
+        )
+
+
+class RepeatedNgramCriteria(_RecordingCriterion):
+    # Tokens inside {{...}} placeholders are skipped: answers repeat placeholders such as
+    # {{CANCEL_TICKET_SECTION}} legitimately, and their BPE pieces would look like a loop
+    name = "repeated_ngram"
+
+    def __init__(self, prompt_length, stop_reasons, tokenizer, size=REPEAT_NGRAM_SIZE,
+                 max_repeats=MAX_NGRAM_REPEATS):
+        super().__init__(prompt_length, stop_reasons)
+        self.tokenizer = tokenizer
+        self.size = size
+        self.max_repeats = max_repeats
+        self._rows = {} # row -> (tokens looked at, tokens outside placeholders, decoded tail)
+
+    def _outside_placeholders(self, row, tokens):
+        # Only tokens added since the last check are decoded
+        seen, kept, tail = self._rows.get(row, (0, [], ""))
+        if seen > len(tokens):
+            seen, kept, tail = 0, [], ""
+        for token in tokens[seen:]:
+            piece = self.tokenizer.decode([token])
+            inside = tail.rfind("{{") > tail.rfind("}}")
+            tail = (tail + piece)[-_PLACEHOLDER_TAIL:]
+            if not (inside or "{" in piece or "}" in piece):
+                kept.append(token)
+        self._rows[row] = (len(tokens), kept, tail)
+        return kept
+
+    def check(self, input_ids):
+        done = []
+        for row, generated in enumerate(input_ids[:, self.prompt_length:].tolist()):
+            tokens = self._outside_placeholders(row, generated)
+            if len(tokens) < self.size * (self.max_repeats + 1):
+                done.append(False)
+                continue
+            last = tokens[-self.size:]
+            seen = sum(
+                1 for i in range(len(tokens) - self.size) if tokens[i:i + self.size] == last
+            )
+            done.append(seen >= self.max_repeats)
+        return torch.tensor(done, device=input_ids.device)
+
+
+class DeadlineCriteria(_RecordingCriterion):
+    name = "deadline"
+
+    def __init__(self, prompt_length, stop_reasons, deadline: float):
+        super().__init__(prompt_length, stop_reasons)
+        self.deadline = deadline # time.perf_counter() value
+
+    def check(self, input_ids):
+        expired = time.perf_counter() >= self.deadline
+        return torch.full((input_ids.shape[0],), expired, device=input_ids.device, dtype=torch.bool)
+
+
+class CancelledCriteria(_RecordingCriterion):
+    name = "cancelled"
+
+    def __init__(self, prompt_length, stop_reasons, cancelled):
+        super().__init__(prompt_length, stop_reasons)
+        self.cancelled = cancelled # threading.Event, set when nobody is reading the output any more
+
+    def check(self, input_ids):
+        return torch.full(
+            (input_ids.shape[0],), self.cancelled.is_set(), device=input_ids.device, dtype=torch.bool
+        )
+
+
+def build_stopping_criteria(tokenizer, inputs, stop_reasons: dict, deadline: float = None, cancelled=None):
+    # inputs: the tokenized (left-padded) prompts. stop_reasons receives {row: criterion name}.
+    # deadline is a time.perf_counter() value; None starts GENERATION_DEADLINE from now.
+    # cancelled, a threading.Event, stops every row once set.
+    prompt_length = inputs["input_ids"].shape[1]
+    prompt_tokens = inputs["attention_mask"].sum(dim=1).tolist()
+    budgets = [int(TOKEN_BUDGET_BASE + TOKENS_PER_PROMPT_TOKEN * n) for n in prompt_tokens]
+    criteria = [
+        TemplateMarkerCriteria(prompt_length, stop_reasons, tokenizer),
+        TokenBudgetCriteria(prompt_length, stop_reasons, tokenizer, budgets),
+    ]
+    if REPEAT_NGRAM_SIZE > 0 and MAX_NGRAM_REPEATS > 0:
+        criteria.append(
+            RepeatedNgramCriteria(prompt_length, stop_reasons, tokenizer, REPEAT_NGRAM_SIZE, MAX_NGRAM_REPEATS)
+        )
+    if deadline is None and GENERATION_DEADLINE > 0:
+        deadline = time.perf_counter() + GENERATION_DEADLINE
+    if deadline is not None:
+        criteria.append(DeadlineCriteria(prompt_length, stop_reasons, deadline))
+    if cancelled is not None:
+        criteria.append(CancelledCriteria(prompt_length, stop_reasons, cancelled))
+    for criterion in criteria:
+        criterion.eos_token_id = tokenizer.eos_token_id
+    return StoppingCriteriaList(criteria)
+
+
+def record_stop_reasons(stop_reasons: dict, sequences, eos_token_id, max_length: int):
+    # One reason per row (a criterion, "eos" or "max_length"), counted in chatbot_generation_stops_total
+    reasons = []
+    for row in range(sequences.shape[0]):
+        reason = stop_reasons.get(row)
+        if reason is None:
+            reason = "max_length" if sequences.shape[1] >= max_length and sequences[row, -1] != eos_token_id else "eos"
+        reasons.append(reason)
+        METRICS.inc("chatbot_generation_stops_total", reason=reason)
+    return reasons
+
+
+def find_template_marker(text: str):
+    # Index of the first restarted template marker, or -1
+    return min((i for i in (text.find(marker) for marker in TEMPLATE_MARKERS) if i != -1), default=-1)
+
+
+def last_sentence_end(text: str):
+    # Index of the last ". ", "! " or "? " in text, or -1
+    return max(text.rfind(". "), text.rfind("! "), text.rfind("? "))
+
+
+def trim_response(response: str, reason: str = None):
+    # Drop a restarted template, and an unfinished last sentence or placeholder if generation was
+    # cut short
+    cut = find_template_marker(response)
+    if cut != -1:
+        response = response[:cut]
+    response = response.strip()
+    if reason in CUT_SHORT:
+        response = UNCLOSED_PLACEHOLDER.sub("", response).rstrip()
+        last_end = last_sentence_end(response)
+        if not SENTENCE_END.search(response) and last_end > len(response) // 2:
+            response = response[:last_end + 1]
+    return response
+
+
+def trim_holdback(text: str):
+    # Length of the suffix of streamed text that trim_response could still drop (or that could
+    # still grow into a template marker): everything after the last sentence end
+    return len(text) - (last_sentence_end(text) + 1)
@@ -0,0 +1,368 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import torch
+
+from backend import process_memory_mb
+from metrics import METRICS
+from scheduler import BUSY_MESSAGE, STAGES, SchedulerBusy
+
+# =============================
+# PRE-FORK WORKER POOL
+# =============================
+
+_STREAM = "stream"
+_DONE = object()
+# Seconds between checks for worker processes that died
+WORKER_CHECK_INTERVAL = 1.0
+
+
+def default_threads_per_worker(num_workers: int):
+    # Split the cores so workers don't oversubscribe them with intra-op threads
+    return max(1, (os.cpu_count() or 1) // max(1, num_workers))
+
+
+def _collect_batch(first, tasks, max_batch_size):
+    # The first task plus whatever batched-stage tasks are already waiting, without blocking.
+    # Streams are never batched: each runs alone, so the other streams waiting go to idle
+    # workers. A stream, or a stop sentinel meant for another worker, is put back.
+    batch = [first]
+    if first[1] == _STREAM:
+        return batch
+    while len(batch) < max_batch_size:
+        try:
+            task = tasks.get_nowait()
+        except queue.Empty:
+            break
+        if task is None or task[1] == _STREAM:
+            tasks.put(task)
+            break
+        batch.append(task)
+    return batch
+
+
+class _StreamCancels:
+    # Worker side of stream cancellation: the parent sends the id of a stream nobody reads any
+    # more, and the stream's event stops its generation at the next token. Only the current
+    # batch's ids are kept, so a cancel arriving after its stream ended is ignored.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._claimed = set()
+        self._events = {}
+
+    def claim(self, task_ids):
+        with self._lock:
+            self._claimed = set(task_ids)
+            self._events = {}
+
+    def event(self, task_id):
+        with self._lock:
+            return self._events.setdefault(task_id, threading.Event())
+
+    def cancel(self, task_id):
+        with self._lock:
+            if task_id in self._claimed:
+                self._events.setdefault(task_id, threading.Event()).set()
+
+    def listen(self, controls):
+        while True:
+            self.cancel(controls.get())
+
+
+def _run_batch(chatbot, batch, results, index, cancels):
+    by_stage = {}
+    for task_id, stage, payload in batch:
+        by_stage.setdefault(stage, []).append((task_id, payload))
+    for stage, items in by_stage.items():
+        start = time.perf_counter()
+        if stage == _STREAM:
+            for task_id, (query, dynamic_placeholders) in items:
+                try:
+                    chunks = []
+                    cancelled = cancels.event(task_id)
+                    for text in chatbot.stream_response(query, dynamic_placeholders, cancelled=cancelled):
+                        chunks.append(text)
+                        results.put((task_id, "chunk", text, index))
+                    results.put((task_id, "result", "".join(chunks).strip(), index))
+                except Exception as e:
+                    results.put((task_id, "error", f"{type(e).__name__}: {e}", index))
+        else:
+            try:
+                values = getattr(chatbot, STAGES[stage])([payload for _, payload in items])
+                for (task_id, _), value in zip(items, values):
+                    results.put((task_id, "result", value, index))
+            except Exception as e:
+                for task_id, _ in items:
+                    results.put((task_id, "error", f"{type(e).__name__}: {e}", index))
+        results.put((None, "timing", (stage, time.perf_counter() - start, len(items)), index))
+
+
+def _worker_main(index, chatbot, tasks, results, controls, threads, max_batch_size):
+    # Runs in the forked child: the models are already in memory, shared copy-on-write with the parent
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # The parent owns shutdown
+    torch.set_num_threads(threads)
+    # Stage latencies, stop reasons, retrieval hits etc. go to the parent's registry (and /metrics)
+    METRICS.forward = lambda kind, name, value, labels: results.put(
+        (None, "metric", (kind, name, value, labels), index)
+    )
+    cancels = _StreamCancels()
+    threading.Thread(target=cancels.listen, args=(controls,), name="stream-cancels", daemon=True).start()
+    results.put((None, "ready", os.getpid(), index))
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        batch = _collect_batch(task, tasks, max_batch_size)
+        # Lets the parent fail these tasks if this process dies, and cancel its streams
+        task_ids = [task_id for task_id, _, _ in batch]
+        cancels.claim(task_ids)
+        results.put((None, "claim", task_ids, index))
+        _run_batch(chatbot, batch, results, index, cancels)
+
+
+class WorkerPool:
+    # Forks num_workers processes after the parent has loaded every model, so weight pages are
+    # shared instead of loaded N times, and generate() calls run on separate interpreters
+    # instead of serializing on one GIL. Tasks go on one shared queue, so whichever worker is
+    # idle takes the next one (together with any batched-stage tasks already waiting; streams
+    # always run one per worker). A worker that dies fails the tasks it had taken. A stream the
+    # caller stops reading is cancelled in its worker, which stops generating at the next token.
+    # submit() matches BatchScheduler.submit(), so the pool can stand in for the scheduler.
+
+    def __init__(self, chatbot, num_workers: int = 2, threads_per_worker: int = None,
+                 max_batch_size: int = 16, max_pending: int = 128, result_timeout: float = 120.0):
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise RuntimeError("WorkerPool needs the fork start method (Linux or macOS)")
+        self.chatbot = chatbot
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker or default_threads_per_worker(num_workers)
+        self.max_pending = max_pending
+        self.result_timeout = result_timeout
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._pending = {} # task id -> (Future, chunk queue or None)
+        self._stats = {"requests": 0, "rejected": 0, "errors": 0}
+        self._worker_tasks = [0] * num_workers
+        self._pids = {}
+        self._claims = {} # task id -> index of the worker running it
+        self._abandoned_streams = set() # Given up before a worker took them: cancelled once one does
+        self._dead = set()
+
+        # Everything a worker touches must exist before the fork, or each child builds its own copy
+        chatbot.preload()
+        chatbot.vocabulary
+        chatbot.prompt_cache
+        chatbot.batch_tokenizer
+        chatbot.draft # Seeded once here; each worker then extends its own copy
+        chatbot.front_end
+
+        context = multiprocessing.get_context("fork")
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._controls = [context.Queue() for _ in range(num_workers)] # Stream cancels, per worker
+        self._processes = [
+            context.Process(
+                target=_worker_main, name=f"chatbot-worker-{index}", daemon=True,
+                args=(index, chatbot, self._tasks, self._results, self._controls[index], self.threads_per_worker,
+                      max_batch_size)
+            )
+            for index in range(num_workers)
+        ]
+        for process in self._processes:
+            process.start()
+        self._reader = threading.Thread(target=self._read_results, name="worker-results", daemon=True)
+        self._reader.start()
+
+    # --- Client side ---
+
+    def _enqueue(self, stage, payload, chunks=None):
+        future = Future()
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self._stats["rejected"] += 1
+                raise SchedulerBusy(BUSY_MESSAGE)
+            task_id = next(self._ids)
+            self._pending[task_id] = (future, chunks)
+            self._stats["requests"] += 1
+        self._tasks.put((task_id, stage, payload))
+        return task_id, future
+
+    def _abandon(self, task_id):
+        # The caller gave up: free the task's max_pending slot, its result is dropped on arrival.
+        # A stream is also cancelled in its worker, so it doesn't keep generating for nobody.
+        with self._lock:
+            _, chunks = self._pending.pop(task_id, (None, None))
+            index = self._claims.pop(task_id, None)
+            if chunks is not None and index is None:
+                self._abandoned_streams.add(task_id)
+        if chunks is not None and index is not None:
+            self._controls[index].put(task_id)
+
+    def submit(self, stage: str, payload):
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage: {stage}")
+        return self._enqueue(stage, payload)[1]
+
+    def call(self, stage: str, payload):
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage: {stage}")
+        task_id, future = self._enqueue(stage, payload)
+        try:
+            return future.result(timeout=self.result_timeout)
+        except FutureTimeout:
+            self._abandon(task_id)
+            raise
+
+    def answer(self, query: str):
+        return self.call("answer", query)
+
+    def stream_response(self, query: str, dynamic_placeholders=None):
+        # Like ChatbotPipeline.stream_response, with generation running in a worker. A Future
+        # can't cross to the worker, so it is resolved here; with None the worker extracts them.
+        if isinstance(dynamic_placeholders, Future):
+            dynamic_placeholders = dynamic_placeholders.result(timeout=self.result_timeout)
+        chunks = queue.Queue()
+        task_id, future = self._enqueue(_STREAM, (query, dynamic_placeholders), chunks)
+        finished = False
+        try:
+            while True:
+                try:
+                    item = chunks.get(timeout=self.result_timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"No output from the worker for {self.result_timeout:g}s")
+                if item is _DONE:
+                    break
+                yield item
+            finished = True
+        finally:
+            if not finished: # Timed out, or the consumer stopped reading
+                self._abandon(task_id)
+        future.result() # Raises the worker's error, if any
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._pending)
+            stats["tasks_per_worker"] = list(self._worker_tasks)
+            pids = dict(self._pids)
+        stats["workers"] = self.num_workers
+        stats["threads_per_worker"] = self.threads_per_worker
+        stats["alive"] = sum(1 for process in self._processes if process.is_alive())
+        stats["memory_mb"] = {
+            "parent": process_memory_mb(),
+            "workers": [process_memory_mb(pids[index]) for index in sorted(pids)],
+        }
+        return stats
+
+    def wait_ready(self, timeout: float = 60.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if len(self._pids) == self.num_workers:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def shutdown(self, wait: bool = True):
+        for _ in self._processes:
+            self._tasks.put(None)
+        if wait:
+            for process in self._processes:
+                process.join(timeout=10)
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+        self._results.put((None, "stop", None, None))
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future, chunks in pending.values():
+            future.set_exception(RuntimeError("Worker pool shut down"))
+            if chunks is not None:
+                chunks.put(_DONE)
+
+    # --- Result side ---
+
+    def _read_results(self):
+        checked = time.monotonic()
+        while True:
+            if time.monotonic() - checked >= WORKER_CHECK_INTERVAL:
+                self._fail_dead_workers()
+                checked = time.monotonic()
+            try:
+                task_id, kind, value, index = self._results.get(timeout=WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                continue
+            if kind == "stop":
+                return
+            if kind == "ready":
+                with self._lock:
+                    self._pids[index] = value
+                continue
+            if kind == "metric":
+                method, name, amount, labels = value
+                getattr(METRICS, method)(name, amount, **labels)
+                continue
+            if kind == "claim":
+                cancel = []
+                with self._lock:
+                    for claimed in value:
+                        if claimed in self._pending:
+                            self._claims[claimed] = index
+                        elif claimed in self._abandoned_streams:
+                            self._abandoned_streams.discard(claimed)
+                            cancel.append(claimed)
+                for task_id in cancel:
+                    self._controls[index].put(task_id)
+                continue
+            if kind == "timing":
+                stage, seconds, items = value
+                METRICS.observe("chatbot_worker_batch_seconds", seconds, stage=stage)
+                continue
+            with self._lock:
+                future, chunks = self._pending.get(task_id, (None, None))
+                if kind != "chunk":
+                    self._pending.pop(task_id, None)
+                    self._claims.pop(task_id, None)
+                    self._worker_tasks[index] += 1
+                    if kind == "error":
+                        self._stats["errors"] += 1
+            if future is None:
+                continue
+            if kind == "chunk":
+                chunks.put(value)
+                continue
+            if kind == "result":
+                future.set_result(value)
+            else:
+                future.set_exception(RuntimeError(value))
+            if chunks is not None:
+                chunks.put(_DONE)
+
+    def _fail_dead_workers(self):
+        # A worker that died (OOM kill, segfault) never answers the tasks it took; once no worker
+        # is left, nothing will run the queued ones either
+        dead = {index for index, process in enumerate(self._processes) if not process.is_alive()} - self._dead
+        if not dead:
+            return
+        self._dead |= dead
+        with self._lock:
+            lost = [task_id for task_id, index in self._claims.items() if index in dead]
+            if len(self._dead) == self.num_workers:
+                lost = list(self._pending)
+            failed = [self._pending.pop(task_id) for task_id in lost if task_id in self._pending]
+            for task_id in lost:
+                self._claims.pop(task_id, None)
+            self._stats["errors"] += len(failed)
+        for index in sorted(dead):
+            print(f"Worker {index} exited with code {self._processes[index].exitcode}")
+        for future, chunks in failed:
+            future.set_exception(RuntimeError("The worker running this task exited"))
+            if chunks is not None:
+                chunks.put(_DONE)